@@ -0,0 +1,221 @@
+# Headless batch runner for Image Recreation Using Cards
+# Runs many targets at once, one EvolutionSession per target in a pool of
+# worker processes, with the same parameters the UI exposes. Every job
+# gets its own results folder with result.png and summary.json, the whole
+# batch gets summary.json in the output folder. Exit code is 0 when every
+# job finished, 1 when any job failed, 2 when no targets were found.
+#
+# Usage:
+#   python Batch.py targets/ "more/*.jpg" [--output Batch] [--jobs N]
+#                   [--loops N] [--generations N] [--simplification N]
+#                   [--no-color] [--weight-color %] [--no-ssim] [--weight-ssim %]
+#                   [--seed N] [--set NAME=VALUE ...] [--resume]
+#
+# With --resume, jobs whose folder has a checkpoint continue from it (with
+# its saved settings, --loops and --set still apply).
+
+import argparse
+import ast
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import get_context
+
+import Main
+
+TARGET_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp")
+
+def findTargets(patterns): #target files from directories, globs and file names (sorted, no duplicates)
+    targets = []
+
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            paths = [os.path.join(pattern, name) for name in os.listdir(pattern)]
+        else:
+            paths = glob.glob(pattern)
+
+        for path in sorted(paths):
+            if os.path.isfile(path) and path.lower().endswith(TARGET_EXTENSIONS) and path not in targets:
+                targets.append(path)
+
+    return targets
+
+def jobFolders(targets, output): #results folder per target, named by file name (numbered when names repeat)
+    folders = []
+    used = set()
+
+    for path in targets:
+        name = os.path.splitext(os.path.basename(path))[0]
+        folder_name = name
+        n = 2
+
+        while folder_name in used:
+            folder_name = name + "_" + str(n)
+            n += 1
+
+        used.add(folder_name)
+        folders.append(os.path.join(output, folder_name))
+
+    return folders
+
+def parseSetting(text): #NAME=VALUE, value is a Python literal or a plain string
+    name, _, value = text.partition("=")
+    name = name.strip()
+
+    if name not in Main.CONFIG_NAMES:
+        raise argparse.ArgumentTypeError("unknown setting " + name)
+
+    try:
+        return name, ast.literal_eval(value)
+    except (ValueError, SyntaxError):
+        return name, value
+
+def runJob(target_path, folder, settings, resume_settings=None): #one target in a worker process, writes and returns its summary (resume_settings continue checkpoint of the folder if there is one)
+    summary = {"target": target_path, "folder": folder, "status": "ok", "error": None,
+               "fitness": None, "loops": 0, "cards": 0, "time": 0.0}
+
+    os.makedirs(folder, exist_ok=True)
+    start = time.perf_counter()
+
+    try:
+        checkpoint_path = os.path.join(folder, Main.CHECKPOINT_FILE)
+
+        if resume_settings is not None and os.path.exists(checkpoint_path):
+            session = Main.EvolutionSession.resume(checkpoint_path, target_path, RESULTS_FOLDER=folder, SHOW_RESULT=False,
+                                                   **resume_settings)
+            summary["resumed_at"] = session.loop
+        else:
+            session = Main.EvolutionSession(target_path, RESULTS_FOLDER=folder, SHOW_RESULT=False, **settings)
+
+        session.run()
+
+        summary["fitness"] = session.committedFitness()
+        summary["loops"] = session.loop
+        summary["cards"] = len(session.card_list)
+        summary["seed"] = session.RANDOM_SEED
+    except Exception as e:
+        summary["status"] = "error"
+        summary["error"] = type(e).__name__ + ": " + str(e)
+
+    summary["time"] = time.perf_counter() - start
+    summary["settings"] = settings
+
+    with open(os.path.join(folder, "summary.json"), "w") as f:
+        json.dump(summary, f, indent=1)
+
+    return summary
+
+def printJob(done, total, summary):
+    name = os.path.basename(summary["folder"])
+
+    if summary["status"] != "ok":
+        print("[" + str(done) + "/" + str(total) + "] " + name + "  failed: " + summary["error"])
+        return
+
+    print("[" + str(done) + "/" + str(total) + "] " + name + f"  fitness {summary['fitness']:.5f}"
+          + "  " + str(summary["loops"]) + " loops  " + str(summary["cards"]) + " cards" + f"  {summary['time']:.1f} s")
+
+def settingsFromArgs(args): #session settings from UI parameters and --set
+    use_color = not args.no_color
+    use_ssim = not args.no_ssim
+
+    weight_color = args.weight_color / 100.0
+    weight_ssim = args.weight_ssim / 100.0
+
+    if use_color and not use_ssim: #same as UI
+        weight_color = 1
+    elif use_ssim and not use_color:
+        weight_ssim = 1
+
+    settings = {
+        "MAX_LOOP_COUNT": args.loops,
+        "GENERATIONS_PER_LOOP": args.generations,
+        "IMAGE_SIMPLIFICATION": args.simplification,
+        "USE_COLOR": use_color,
+        "WEIGHT_COLOR": weight_color,
+        "USE_SSIM": use_ssim,
+        "WEIGHT_SSIM": weight_ssim,
+        "RANDOM_SEED": args.seed
+    }
+
+    settings.update(dict(args.set))
+
+    return settings
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless batch runner for Image Recreation Using Cards")
+    parser.add_argument("targets", nargs="+", help="target images, directories or globs")
+    parser.add_argument("--output", default="Batch", help="folder for results of all jobs")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="number of worker processes")
+    parser.add_argument("--loops", type=int, default=Main.MAX_LOOP_COUNT)
+    parser.add_argument("--generations", type=int, default=Main.GENERATIONS_PER_LOOP)
+    parser.add_argument("--simplification", type=int, default=Main.IMAGE_SIMPLIFICATION)
+    parser.add_argument("--no-color", action="store_true")
+    parser.add_argument("--weight-color", type=int, default=int(Main.WEIGHT_COLOR * 100), help="percent")
+    parser.add_argument("--no-ssim", action="store_true")
+    parser.add_argument("--weight-ssim", type=int, default=int(Main.WEIGHT_SSIM * 100), help="percent")
+    parser.add_argument("--seed", type=int, default=Main.RANDOM_SEED)
+    parser.add_argument("--set", type=parseSetting, action="append", default=[], metavar="NAME=VALUE",
+                        help="any other setting of Main.py, e.g. --set USE_PYRAMID=True")
+    parser.add_argument("--resume", action="store_true", help="continue jobs from checkpoints in their folders")
+
+    args = parser.parse_args()
+
+    targets = findTargets(args.targets)
+
+    if not targets:
+        print("No targets found", file=sys.stderr)
+        return 2
+
+    if args.simplification < 1:
+        print("Simplification must be at least 1", file=sys.stderr)
+        return 2
+
+    settings = settingsFromArgs(args)
+    resume_settings = {"MAX_LOOP_COUNT": args.loops, **dict(args.set)} if args.resume else None #settings that override checkpoint
+    folders = jobFolders(targets, args.output)
+    jobs = min(max(1, args.jobs), len(targets))
+
+    start = time.perf_counter()
+    summaries = []
+
+    if jobs == 1: #no need for worker processes
+        for target_path, folder in zip(targets, folders):
+            summaries.append(runJob(target_path, folder, settings, resume_settings))
+            printJob(len(summaries), len(targets), summaries[-1])
+    else:
+        executor = ProcessPoolExecutor(max_workers=jobs, mp_context=get_context("spawn"))
+
+        try:
+            futures = [executor.submit(runJob, target_path, folder, settings, resume_settings) for target_path, folder in zip(targets, folders)]
+
+            for fut in as_completed(futures):
+                summaries.append(fut.result())
+                printJob(len(summaries), len(targets), summaries[-1])
+        except KeyboardInterrupt:
+            executor.shutdown(wait=False, cancel_futures=True)
+            print("Interrupted", file=sys.stderr)
+            return 130
+
+        executor.shutdown()
+
+    failed = sum(1 for summary in summaries if summary["status"] != "ok")
+    wall = time.perf_counter() - start
+
+    batch = {"jobs": len(summaries), "failed": failed, "time": wall, "workers": jobs,
+             "summaries": sorted(summaries, key=lambda summary: summary["folder"])}
+
+    os.makedirs(args.output, exist_ok=True)
+
+    with open(os.path.join(args.output, "summary.json"), "w") as f:
+        json.dump(batch, f, indent=1)
+
+    print(str(len(summaries) - failed) + " of " + str(len(summaries)) + " jobs finished" + f" in {wall:.1f} s")
+
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
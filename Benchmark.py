@@ -0,0 +1,373 @@
+# Benchmarks for Image Recreation Using Cards
+# Runs the evolution headless on synthetic targets with fixed seeds, so
+# settings can be compared by numbers instead of by eye.
+#
+# Usage:
+#   python Benchmark.py pyramid [--loops N] [--generations N] [--size WxH]
+#   python Benchmark.py hotpaths [--sizes WxH,WxH] [--simplifications N,N] [--cards N,N] [--workers N,N]
+#                                [--backend threads|processes] [--output bench.json] [--baseline base.json]
+#   python Benchmark.py compare --baseline base.json --current bench.json [--threshold 0.1]
+#
+# hotpaths measures latency of the render and scoring functions on a warm
+# session, then runs every case (sweeping one setting at a time) in a fresh
+# process for candidates scored per second, loops per minute and peak
+# memory. Results go to a JSON file, compare flags metrics that got worse
+# than the baseline by more than the threshold and exits with 1 if any did.
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+import Main
+
+try: #peak memory of a process, not available on Windows
+    import resource
+except ImportError:
+    resource = None
+
+BENCH_VERSION = 1
+
+#calls per function in latency measurement (generationLoop is a whole loop, so it gets fewer)
+LATENCY_CALLS = 200
+LATENCY_LOOPS = 3
+
+#metric: (better direction, threshold kind), relative thresholds use --threshold,
+#fitness is compared absolutely since seeded runs repeat exactly
+METRICS = {
+    "median_ms": ("lower", "relative"),
+    "candidates_per_s": ("higher", "relative"),
+    "loops_per_min": ("higher", "relative"),
+    "peak_mb": ("lower", "relative"),
+    "fitness": ("higher", "absolute")
+}
+FITNESS_TOLERANCE = 0.005
+
+def makeTarget(width, height, seed): #synthetic target: gradient background with random shapes
+    rng = np.random.default_rng(seed)
+
+    y, x = np.mgrid[0:height, 0:width]
+    base = np.dstack((x * 255.0 / width, y * 255.0 / height, np.full((height, width), 96.0)))
+
+    img = Image.fromarray(base.astype(np.uint8), "RGB")
+    draw = ImageDraw.Draw(img)
+
+    for _ in range(12):
+        x0, x1 = sorted(rng.integers(0, width, 2))
+        y0, y1 = sorted(rng.integers(0, height, 2))
+        color = tuple(int(c) for c in rng.integers(0, 256, 3))
+
+        if rng.random() < 0.5:
+            draw.rectangle((x0, y0, x1, y1), fill=color)
+        else:
+            draw.ellipse((x0, y0, x1, y1), fill=color)
+
+    return img
+
+def runOnce(target_path, settings, loops, generations, simplification, seed): #one headless run, returns wall time and final fitness
+    start = time.perf_counter()
+
+    session = Main.EvolutionSession(target_path, MAX_LOOP_COUNT=loops, GENERATIONS_PER_LOOP=generations,
+                                    IMAGE_SIMPLIFICATION=simplification, RANDOM_SEED=seed, **settings)
+    session.run()
+
+    wall = time.perf_counter() - start
+
+    return {"time": wall, "fitness": session.engine.committedScore()}
+
+def benchPyramid(args): #time vs final fitness of coarse-to-fine screening
+    width, height = args.size
+
+    cases = [("off", {"USE_PYRAMID": False})]
+
+    for fraction in (0.5, 0.25, 0.1):
+        cases.append(("x4 keep " + str(fraction), {"USE_PYRAMID": True, "PYRAMID_FACTORS": (4,), "PYRAMID_KEEP_FRACTION": fraction}))
+
+    cases.append(("x4 x2 keep 0.25", {"USE_PYRAMID": True, "PYRAMID_FACTORS": (4, 2), "PYRAMID_KEEP_FRACTION": 0.25}))
+
+    with tempfile.TemporaryDirectory() as folder:
+        target_path = os.path.join(folder, "target.png")
+        makeTarget(width, height, args.seed).save(target_path)
+
+        headless = {"RESULTS_FOLDER": folder, "SHOW_RESULT": False, "SNAPSHOT_EVERY": args.loops + 1}
+
+        baseline = None
+
+        print("case".ljust(18) + "time (s)".rjust(10) + "speedup".rjust(10) + "fitness".rjust(10) + "delta".rjust(10))
+
+        for name, settings in cases:
+            result = runOnce(target_path, {**headless, **settings}, args.loops, args.generations, args.simplification, args.seed)
+
+            if baseline is None:
+                baseline = result
+
+            print(name.ljust(18) + f"{result['time']:10.2f}" + f"{baseline['time'] / result['time']:10.2f}"
+                  + f"{result['fitness']:10.5f}" + f"{result['fitness'] - baseline['fitness']:+10.5f}")
+
+def peakMemoryMB(): #peak resident memory of this process (None where it cannot be read)
+    if resource is None:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    return peak / 1024 / 1024 if platform.system() == "Darwin" else peak / 1024 #bytes on macOS, KB elsewhere
+
+def timeCalls(function, args_list): #latency of every call in milliseconds
+    times = []
+
+    for args in args_list:
+        start = time.perf_counter()
+        function(*args)
+        times.append((time.perf_counter() - start) * 1000)
+
+    return {"calls": len(times), "median_ms": statistics.median(times), "mean_ms": statistics.fmean(times),
+            "min_ms": min(times), "max_ms": max(times)}
+
+def benchLatency(target_path, settings, seed): #per-function latency on a warm session (caches filled by one pass first)
+    session = Main.EvolutionSession(target_path, RANDOM_SEED=seed, **settings)
+
+    cards = session.createRandomCards(LATENCY_CALLS)
+    card_args = [(cards[i],) for i in range(len(cards))]
+
+    scratch = Image.new("RGBA", (session.CANVAS_WIDTH, session.CANVAS_HEIGHT), session.CANVAS_BACKGROUND)
+    faces = [session.deck.images[int(card["card_no"])] for card in cards]
+
+    functions = {
+        "applyTint": (Main.applyTint, [(faces[i], tuple(int(c) for c in cards[i]["tint"]), float(cards[i]["tint_power"])) for i in range(len(cards))]),
+        "placeCard": (session.placeCard, [(scratch, card) for (card,) in card_args]),
+        "placeSmallCard": (session.placeSmallCard, [(session.engine, card) for (card,) in card_args]),
+        "calculateFitness": (session.calculateFitness, card_args),
+        "calculateFitnessBatch": (session.calculateFitnessBatch, [(cards[start:start + session.SCORE_CHUNK],) for start in range(0, len(cards), session.SCORE_CHUNK)])
+    }
+
+    results = {}
+
+    for name, (function, args_list) in functions.items():
+        timeCalls(function, args_list) #warming sprite caches
+        results[name] = timeCalls(function, args_list)
+
+    session.generationLoop(1, None, None)
+    results["generationLoop"] = timeCalls(session.generationLoop, [(n + 2, None, None) for n in range(LATENCY_LOOPS)])
+
+    return results
+
+def runCase(target_path, settings, loops, generations, seed): #one headless run in a fresh process, returns its throughput
+    start = time.perf_counter()
+
+    session = Main.EvolutionSession(target_path, MAX_LOOP_COUNT=loops, GENERATIONS_PER_LOOP=generations, RANDOM_SEED=seed, **settings)
+
+    setup = time.perf_counter() - start
+
+    #counting candidates that enter scoring of a generation
+    scored = [0]
+    name = "screenPopulation" if session.pyramid_levels else "scorePopulation"
+    score = getattr(session, name)
+
+    def counted(generation_cards, stop_event):
+        scored[0] += len(generation_cards)
+        return score(generation_cards, stop_event)
+
+    setattr(session, name, counted)
+
+    start = time.perf_counter()
+    session.run()
+    wall = time.perf_counter() - start
+
+    return {"setup_s": setup, "time_s": wall, "loops": session.loop, "loops_per_min": session.loop / wall * 60,
+            "candidates": scored[0], "candidates_per_s": scored[0] / wall, "peak_mb": peakMemoryMB(),
+            "fitness": session.committedFitness()}
+
+def hotpathCases(args): #(name, size, settings) of every case, each sweep changes one setting of the base case
+    base_cards = args.cards[0]
+    cases = []
+
+    def cardSettings(total): #population keeps CARDS_WINNERS_COUNT * (CARDS_MUTATIONS_COUNT + 1) = CARDS_TOTAL_COUNT
+        return {"CARDS_TOTAL_COUNT": total, "CARDS_WINNERS_COUNT": max(1, total // (Main.CARDS_MUTATIONS_COUNT + 1))}
+
+    for width, height in args.sizes:
+        size = str(width) + "x" + str(height)
+        base = {"IMAGE_SIMPLIFICATION": args.simplifications[0], **cardSettings(base_cards)}
+
+        cases.append((size + " base", (width, height), base))
+
+        for simplification in args.simplifications[1:]:
+            cases.append((size + " simplification " + str(simplification), (width, height), {**base, "IMAGE_SIMPLIFICATION": simplification}))
+
+        for total in args.cards[1:]:
+            cases.append((size + " cards " + str(total), (width, height), {**base, **cardSettings(total)}))
+
+        for workers in args.workers:
+            cases.append((size + " " + args.backend + " " + str(workers), (width, height),
+                          {**base, "SCORE_BACKEND": args.backend, "SCORE_WORKERS": workers}))
+
+    return cases
+
+def benchHotpaths(args): #latency, throughput and memory across sizes and settings, written to JSON
+    results = {
+        "version": BENCH_VERSION,
+        "machine": {"platform": platform.platform(), "python": platform.python_version(), "cpus": os.cpu_count(),
+                    "numpy": np.__version__},
+        "options": {"loops": args.loops, "generations": args.generations, "seed": args.seed},
+        "latency": {},
+        "cases": []
+    }
+
+    with tempfile.TemporaryDirectory() as folder:
+        #same sprites for every run, loops always run to the end
+        headless = {"RESULTS_FOLDER": folder, "SHOW_RESULT": False, "SNAPSHOT_EVERY": args.loops + 1,
+                    "CHECKPOINT_EVERY": 0, "LOOP_PATIENCE": 0}
+
+        targets = {}
+
+        for width, height in args.sizes:
+            targets[(width, height)] = os.path.join(folder, "target_" + str(width) + "x" + str(height) + ".png")
+            makeTarget(width, height, args.seed).save(targets[(width, height)])
+
+        print("latency".ljust(34) + "median ms".rjust(12) + "mean ms".rjust(12) + "min ms".rjust(12))
+
+        for width, height in args.sizes:
+            size = str(width) + "x" + str(height)
+            base = {**headless, **hotpathCases(args)[0][2], "GENERATIONS_PER_LOOP": args.generations}
+            latency = benchLatency(targets[(width, height)], base, args.seed)
+
+            for name, result in latency.items():
+                results["latency"][size + " " + name] = result
+
+                print((size + " " + name).ljust(34) + f"{result['median_ms']:12.3f}{result['mean_ms']:12.3f}{result['min_ms']:12.3f}")
+
+        print()
+        print("case".ljust(34) + "loops/min".rjust(11) + "cand/s".rjust(10) + "peak MB".rjust(9) + "fitness".rjust(10))
+
+        for name, size, settings in hotpathCases(args):
+            #fresh process per case, so caches start cold and peak memory belongs to the case
+            with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as executor:
+                result = executor.submit(runCase, targets[size], {**headless, **settings}, args.loops, args.generations, args.seed).result()
+
+            results["cases"].append({"name": name, "size": list(size), "settings": settings, **result})
+
+            peak = "-" if result["peak_mb"] is None else f"{result['peak_mb']:.0f}"
+
+            print(name.ljust(34) + f"{result['loops_per_min']:11.1f}{result['candidates_per_s']:10.0f}" + peak.rjust(9) + f"{result['fitness']:10.5f}")
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=1)
+
+    print("\nResults written to " + args.output)
+
+    if args.baseline:
+        return compareResults(args.baseline, args.output, args.threshold)
+
+    return 0
+
+def compareMetric(metric, old, new, threshold): #(change, regressed) of one metric
+    direction, kind = METRICS[metric]
+
+    if kind == "absolute":
+        change = new - old
+        worse = -change if direction == "higher" else change
+
+        return change, worse > FITNESS_TOLERANCE
+
+    change = (new - old) / old if old else 0.0
+    worse = -change if direction == "higher" else change
+
+    return change, worse > threshold
+
+def compareResults(baseline_path, current_path, threshold): #printing changes against baseline, returns 1 if anything regressed
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+
+    with open(current_path) as f:
+        current = json.load(f)
+
+    rows = []
+
+    for name, result in current["latency"].items():
+        if name in baseline["latency"]:
+            rows.append((name, "median_ms", baseline["latency"][name]["median_ms"], result["median_ms"]))
+
+    baseline_cases = {case["name"]: case for case in baseline["cases"]}
+
+    for case in current["cases"]:
+        old = baseline_cases.get(case["name"])
+
+        if old is None:
+            continue
+
+        for metric in ("candidates_per_s", "loops_per_min", "peak_mb", "fitness"):
+            if old.get(metric) is not None and case.get(metric) is not None:
+                rows.append((case["name"], metric, old[metric], case[metric]))
+
+    regressions = 0
+
+    print("name".ljust(34) + "metric".ljust(18) + "baseline".rjust(12) + "current".rjust(12) + "change".rjust(10))
+
+    for name, metric, old, new in rows:
+        change, regressed = compareMetric(metric, old, new, threshold)
+        regressions += regressed
+
+        change_text = f"{change:+10.5f}" if METRICS[metric][1] == "absolute" else f"{change * 100:+9.1f}%"
+
+        print(name.ljust(34) + metric.ljust(18) + f"{old:12.4f}{new:12.4f}" + change_text + ("  REGRESSION" if regressed else ""))
+
+    if baseline.get("options") != current.get("options"):
+        print("Warning: runs used different options, " + str(baseline.get("options")) + " vs " + str(current.get("options")))
+
+    print(str(regressions) + " regressions in " + str(len(rows)) + " metrics (threshold " + f"{threshold * 100:.0f}%" + ")")
+
+    return 1 if regressions else 0
+
+def parseSize(text):
+    width, height = text.lower().split("x")
+
+    return int(width), int(height)
+
+def parseList(kind): #comma separated values
+    def parse(text):
+        return [kind(value) for value in text.split(",") if value]
+
+    return parse
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks for Image Recreation Using Cards")
+    parser.add_argument("suite", choices=["pyramid", "hotpaths", "compare"])
+    parser.add_argument("--loops", type=int, default=20)
+    parser.add_argument("--generations", type=int, default=10)
+    parser.add_argument("--simplification", type=int, default=4)
+    parser.add_argument("--size", type=parseSize, default=(960, 540))
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--sizes", type=parseList(parseSize), default=[(480, 270), (960, 540)], help="hotpaths target sizes")
+    parser.add_argument("--simplifications", type=parseList(int), default=[4, 8], help="hotpaths IMAGE_SIMPLIFICATION sweep (first is base)")
+    parser.add_argument("--cards", type=parseList(int), default=[100, 200], help="hotpaths CARDS_TOTAL_COUNT sweep (first is base)")
+    parser.add_argument("--workers", type=parseList(int), default=[2, 4], help="hotpaths SCORE_WORKERS sweep")
+    parser.add_argument("--backend", choices=["threads", "processes"], default="threads", help="backend of SCORE_WORKERS sweep")
+    parser.add_argument("--output", default="bench.json", help="hotpaths results file")
+    parser.add_argument("--baseline", default=None, help="results file to compare against")
+    parser.add_argument("--current", default="bench.json", help="compare: results file to check")
+    parser.add_argument("--threshold", type=float, default=0.1, help="relative change counted as regression")
+
+    args = parser.parse_args()
+
+    if args.suite == "pyramid":
+        benchPyramid(args)
+    elif args.suite == "hotpaths":
+        return benchHotpaths(args)
+    elif args.suite == "compare":
+        if not args.baseline:
+            parser.error("compare needs --baseline")
+
+        return compareResults(args.baseline, args.current, args.threshold)
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,131 @@
+# Card face index for Image Recreation Using Cards
+# Every deck sprite gets a small descriptor: luminance and edge strength
+# averaged over a grid of blocks, each part normalised to zero mean and
+# unit length (tint changes the colour, not the pattern). The same grid,
+# rotated and scaled like a candidate, is sampled from the target, so the
+# faces that fit the target under a footprint are found by a brute force
+# nearest neighbour search over the (small) deck.
+
+import copy
+
+import numpy as np
+
+from Sampler import integralImage, boxMeans
+from ScoreEngine import toGray
+
+#blocks of descriptor grid across and down the card
+GRID_WIDTH = 3
+GRID_HEIGHT = 4
+
+#weight of edge part against luminance part in distance
+EDGE_WEIGHT = 0.5
+
+def gradientMagnitude(gray): #per-pixel edge strength
+    gy, gx = np.gradient(gray)
+
+    return np.hypot(gx, gy)
+
+def normalise(parts): #zero mean, unit length along last axis (flat parts stay zero)
+    parts = parts - parts.mean(axis=-1, keepdims=True)
+    norm = np.linalg.norm(parts, axis=-1, keepdims=True)
+
+    return parts / np.maximum(norm, 1e-6)
+
+class CardIndex:
+    def __init__(self, card_images, grid=(GRID_WIDTH, GRID_HEIGHT), edge_weight=EDGE_WEIGHT):
+        self.grid = grid
+        self.edge_weight = edge_weight
+
+        self.card_nos = np.array(sorted(card_images), dtype=np.int16)
+        self.descriptors = np.stack([self._cardDescriptor(card_images[no]) for no in self.card_nos])
+
+        self._lum_integral = None
+        self._edge_integral = None
+
+    def _cardDescriptor(self, img): #descriptor of upright card face (alpha composited over white)
+        arr = np.asarray(img, dtype=np.float32)
+        alpha = arr[:, :, 3:] / 255.0
+        rgb = arr[:, :, :3] * alpha + 255.0 * (1 - alpha)
+
+        gray = toGray(rgb)
+        height, width = gray.shape
+
+        return self._describe(integralImage(gray), integralImage(gradientMagnitude(gray)),
+                              np.array([width / 2]), np.array([height / 2]),
+                              np.array([width]), np.array([height]), np.array([0.0]))[0]
+
+    def _describe(self, lum_integral, edge_integral, cx, cy, width, height, rotation): #descriptors of n footprints (centre, upright size, rotation in degrees)
+        grid_w, grid_h = self.grid
+
+        #block centres in card frame (relative to card size), rotated like PIL rotate (counter clockwise)
+        u = (np.arange(grid_w) + 0.5) / grid_w - 0.5
+        v = (np.arange(grid_h) + 0.5) / grid_h - 0.5
+        u, v = np.meshgrid(u, v)
+        u = u.ravel()[None, :]
+        v = v.ravel()[None, :]
+
+        dx = u * width[:, None]
+        dy = v * height[:, None]
+
+        angle = np.radians(rotation)[:, None]
+        cos = np.cos(angle)
+        sin = np.sin(angle)
+
+        bx = cx[:, None] + dx * cos + dy * sin
+        by = cy[:, None] - dx * sin + dy * cos
+
+        #blocks stay axis aligned, a square which fits inside the rotated block
+        spread = np.abs(np.cos(angle[:, 0])) + np.abs(np.sin(angle[:, 0]))
+        half = (np.minimum(width / grid_w, height / grid_h) / spread / 2)[:, None]
+
+        lum = boxMeans(lum_integral, bx, by, half, half)
+        edge = boxMeans(edge_integral, bx, by, half, half)
+
+        return np.concatenate((normalise(lum), self.edge_weight * normalise(edge)), axis=1)
+
+    def setTarget(self, target_rgb): #target (float32 HxWx3) the footprints are sampled from
+        gray = toGray(target_rgb)
+
+        self._lum_integral = integralImage(gray)
+        self._edge_integral = integralImage(gradientMagnitude(gray))
+
+    def forTarget(self, target_rgb): #index sharing card descriptors with this one, reading footprints from target_rgb
+        index = copy.copy(self)
+        index.setTarget(target_rgb)
+
+        return index
+
+    def query(self, cx, cy, width, height, rotation): #target descriptors under n footprints (in target pixels)
+        return self._describe(self._lum_integral, self._edge_integral,
+                              np.asarray(cx, dtype=np.float64), np.asarray(cy, dtype=np.float64),
+                              np.asarray(width, dtype=np.float64), np.asarray(height, dtype=np.float64),
+                              np.asarray(rotation, dtype=np.float64))
+
+    def nearest(self, descriptors, k=1): #card_no of k nearest faces for every descriptor (nearest first)
+        distances = ((descriptors[:, None, :] - self.descriptors[None, :, :]) ** 2).sum(axis=2)
+        k = min(k, len(self.card_nos))
+
+        order = np.argsort(distances, axis=1, kind="stable")[:, :k]
+
+        return self.card_nos[order]
+
+    def choose(self, rng, population, simplification, card_size, top_k=3): #card_no fitting target under every card of population (random one of top_k)
+        card_w, card_h = card_size
+
+        scale = population["scale"].astype(np.float64)
+        angle = np.radians(population["rotation"].astype(np.float64))
+
+        #population keeps top left corner of rotated card in full size coordinates
+        rotated_w = (np.abs(card_w * np.cos(angle)) + np.abs(card_h * np.sin(angle))) * scale
+        rotated_h = (np.abs(card_w * np.sin(angle)) + np.abs(card_h * np.cos(angle))) * scale
+
+        cx = (population["x"] + rotated_w / 2) / simplification
+        cy = (population["y"] + rotated_h / 2) / simplification
+
+        descriptors = self.query(cx, cy, card_w * scale / simplification, card_h * scale / simplification,
+                                 population["rotation"])
+
+        candidates = self.nearest(descriptors, top_k)
+        pick = rng.integers(0, candidates.shape[1], len(population))
+
+        return candidates[np.arange(len(population)), pick]
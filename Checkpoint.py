@@ -0,0 +1,44 @@
+# Checkpoints for Image Recreation Using Cards
+# Small JSON file with everything needed to continue a run: settings,
+# committed cards (genome fields as lists), random generator state, loop
+# counter and fitness history. Canvases are not stored, they are rebuilt
+# by replaying the cards, so the file stays small and can be moved
+# between machines.
+
+import json
+import os
+
+import numpy as np
+
+CHECKPOINT_VERSION = 1
+
+def writeCheckpoint(path, state): #writing state dict, file is replaced only once it is complete
+    folder = os.path.dirname(path)
+
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+
+    state = dict(state, version=CHECKPOINT_VERSION)
+
+    with open(path + ".tmp", "w") as f:
+        json.dump(state, f, separators=(",", ":"))
+
+    os.replace(path + ".tmp", path)
+
+def readCheckpoint(path): #state dict of checkpoint file
+    with open(path) as f:
+        state = json.load(f)
+
+    if state.get("version") != CHECKPOINT_VERSION:
+        raise ValueError("Unsupported checkpoint version in " + path)
+
+    return state
+
+def rngState(rng): #JSON friendly state of numpy random generator
+    return rng.bit_generator.state
+
+def restoreRng(state): #numpy random generator continuing from saved state
+    rng = np.random.Generator(getattr(np.random, state["bit_generator"])())
+    rng.bit_generator.state = state
+
+    return rng
@@ -1,17 +1,58 @@
+# Deck tools for Image Recreation Using Cards
+# Without arguments prints the card dictionary for CardDeck.py from files
+# in the Deck folder. With --atlas packs the deck listed in CardDeck.py
+# into one memory-mappable atlas with mip levels (see DeckAtlas.py).
+#
+# Usage:
+#   python CreateDeckList.py [--folder Deck]
+#   python CreateDeckList.py --atlas [--folder Deck] [--min-mip N]
+
+import argparse
 import os
 
-file_names = []
+import DeckAtlas
+
 folder_path = "Deck"
 
-if os.path.exists(folder_path) and os.path.isdir(folder_path):
-    for entry in os.listdir(folder_path):
-        full_path = os.path.join(folder_path, entry)
-        if os.path.isfile(full_path):
-            file_names.append(entry)
+def listDeck(folder): #file names in deck folder (atlas files are not cards)
+    file_names = []
+
+    if os.path.exists(folder) and os.path.isdir(folder):
+        for entry in os.listdir(folder):
+            full_path = os.path.join(folder, entry)
+            if os.path.isfile(full_path) and entry.lower().endswith(".png"):
+                file_names.append(entry)
 
-if file_names:
+    return file_names
+
+def printDeckList(file_names):
     count = 1
     for filename in file_names:
         print("    " + str(count) + ': "' + filename + '",')
         count+=1
 
+def main():
+    parser = argparse.ArgumentParser(description="Deck tools for Image Recreation Using Cards")
+    parser.add_argument("--atlas", action="store_true", help="build deck atlas from CardDeck.py instead of printing the list")
+    parser.add_argument("--folder", default=folder_path)
+    parser.add_argument("--min-mip", type=int, default=DeckAtlas.MIN_MIP_SIZE, help="smallest side of the smallest mip level")
+
+    args = parser.parse_args()
+
+    if args.atlas:
+        from CardDeck import cards
+
+        manifest = DeckAtlas.buildAtlas(args.folder, cards, args.min_mip)
+        levels = max(len(entry["mips"]) for entry in manifest["cards"].values())
+
+        print("Packed " + str(len(manifest["cards"])) + " cards, " + str(levels) + " mip levels, "
+              + str(round(manifest["bytes"] / 1024 / 1024, 1)) + " MB into " + os.path.join(args.folder, DeckAtlas.ATLAS_FILE))
+        return
+
+    file_names = listDeck(args.folder)
+
+    if file_names:
+        printDeckList(file_names)
+
+if __name__ == "__main__":
+    main()
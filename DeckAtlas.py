@@ -0,0 +1,125 @@
+# Deck atlas for Image Recreation Using Cards
+# Whole deck packed into one raw RGBA file with several mip levels of every
+# card plus a JSON manifest (offsets, sizes and the PNG files it was built
+# from). Runs map the atlas with np.memmap instead of decoding PNGs, and
+# sprites are resampled from the nearest mip instead of the full size face.
+#
+# Build: python CreateDeckList.py --atlas
+
+import json
+import os
+
+import numpy as np
+from PIL import Image
+
+ATLAS_FILE = "deck_atlas.bin"
+MANIFEST_FILE = "deck_atlas.json"
+ATLAS_VERSION = 1
+
+#smallest side of the smallest mip level
+MIN_MIP_SIZE = 8
+
+def fileStamp(path): #size and modification time, used to notice changed PNGs
+    stat = os.stat(path)
+
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+def mipSizes(width, height, min_size=MIN_MIP_SIZE): #sizes of mip levels, full size first
+    sizes = [(width, height)]
+
+    while min(width, height) // 2 >= min_size:
+        width //= 2
+        height //= 2
+        sizes.append((width, height))
+
+    return sizes
+
+def buildAtlas(folder, card_files, min_size=MIN_MIP_SIZE): #packing card_files ({card_no: file name}) from folder, returns manifest
+    manifest = {"version": ATLAS_VERSION, "cards": {}}
+    offset = 0
+
+    atlas_path = os.path.join(folder, ATLAS_FILE)
+    manifest_path = os.path.join(folder, MANIFEST_FILE)
+
+    with open(atlas_path + ".tmp", "wb") as atlas:
+        for card_no in sorted(card_files):
+            file_path = os.path.join(folder, card_files[card_no])
+            img = Image.open(file_path).convert("RGBA")
+
+            mips = []
+
+            for width, height in mipSizes(img.width, img.height, min_size):
+                level = img if (width, height) == img.size else img.resize((width, height), Image.LANCZOS)
+                data = np.asarray(level, dtype=np.uint8).tobytes()
+
+                atlas.write(data)
+                mips.append([offset, width, height])
+                offset += len(data)
+
+            manifest["cards"][str(card_no)] = {"file": card_files[card_no], **fileStamp(file_path), "mips": mips}
+
+    manifest["bytes"] = offset
+
+    with open(manifest_path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=1)
+
+    #replacing both files only once they are complete
+    os.replace(atlas_path + ".tmp", atlas_path)
+    os.replace(manifest_path + ".tmp", manifest_path)
+
+    return manifest
+
+class DeckAtlas:
+    def __init__(self, atlas_path, manifest):
+        self.manifest = manifest
+        self.data = np.memmap(atlas_path, dtype=np.uint8, mode="r", shape=(manifest["bytes"],))
+
+        self._mips = {int(card_no): entry["mips"] for card_no, entry in manifest["cards"].items()}
+
+    @classmethod
+    def open(cls, folder, card_files): #atlas of folder, None if it is missing or older than any of card_files
+        atlas_path = os.path.join(folder, ATLAS_FILE)
+        manifest_path = os.path.join(folder, MANIFEST_FILE)
+
+        if not (os.path.exists(atlas_path) and os.path.exists(manifest_path)):
+            return None
+
+        try:
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if manifest.get("version") != ATLAS_VERSION or os.path.getsize(atlas_path) != manifest.get("bytes"):
+            return None
+
+        for card_no, file_name in card_files.items():
+            entry = manifest["cards"].get(str(card_no))
+
+            if entry is None or entry["file"] != file_name:
+                return None
+
+            file_path = os.path.join(folder, file_name)
+
+            if os.path.exists(file_path) and fileStamp(file_path) != {"size": entry["size"], "mtime_ns": entry["mtime_ns"]}:
+                return None #PNG changed since atlas was built (atlas alone, without PNGs, is fine)
+
+        return cls(atlas_path, manifest)
+
+    def levelArray(self, card_no, level): #RGBA uint8 view of one mip level (read only, no copy)
+        offset, width, height = self._mips[card_no][level]
+
+        return self.data[offset:offset + width * height * 4].reshape(height, width, 4)
+
+    def image(self, card_no): #full size card face as PIL image
+        return Image.fromarray(np.array(self.levelArray(card_no, 0)), "RGBA")
+
+    def mip(self, card_no, width, height): #smallest mip level not smaller than width x height, as PIL image
+        mips = self._mips[card_no]
+        level = 0
+
+        for i, (_, mip_width, mip_height) in enumerate(mips):
+            if mip_width >= width and mip_height >= height:
+                level = i
+
+        return Image.fromarray(np.array(self.levelArray(card_no, level)), "RGBA")
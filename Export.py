@@ -0,0 +1,244 @@
+# Export for Image Recreation Using Cards
+# Accepted cards are saved as a small genome document (canvas size, card
+# size and card genomes), which can be rendered again at any scale. The
+# renderer works in tiles on a memory-mapped output: every tile only
+# touches cards whose rotated bounding box intersects it, and each card is
+# mapped straight from its full size face with one affine transform, so
+# neither the output nor any scaled sprite has to fit in memory. Faces
+# are loaded by the document's own deck mapping (card_no -> file name),
+# so documents keep rendering right when the deck list changes.
+#
+# Usage:
+#   python Export.py cards.json print.png [--scale 8] [--tile 2048] [--deck Deck]
+#   (.npy output keeps the memory-mapped RGBA array instead of a PNG)
+
+import argparse
+import json
+import os
+import struct
+import zlib
+
+import numpy as np
+from PIL import Image
+
+import Genome
+
+DOCUMENT_VERSION = 1
+TILE_SIZE = 2048
+
+#rows of output encoded at once by PNG writer
+PNG_BAND_ROWS = 256
+
+def writeDocument(path, canvas_size, card_size, background, card_files, card_list): #writing genome document of committed cards
+    population = np.array(card_list, dtype=Genome.GENOME_DTYPE)
+
+    document = {
+        "version": DOCUMENT_VERSION,
+        "canvas": list(canvas_size),
+        "card_size": list(card_size),
+        "background": list(background),
+        "deck": {str(card_no): name for card_no, name in card_files.items()},
+        "cards": Genome.populationToLists(population)
+    }
+
+    with open(path + ".tmp", "w") as f:
+        json.dump(document, f, separators=(",", ":"))
+
+    os.replace(path + ".tmp", path)
+
+def readDocument(path):
+    with open(path) as f:
+        document = json.load(f)
+
+    if document.get("version") != DOCUMENT_VERSION:
+        raise ValueError("Unsupported document version in " + path)
+
+    return document
+
+def deckFaces(document, folder): #card faces of the document's own deck mapping (card_no -> file name), loaded from folder
+    used = set(int(card_no) for card_no in document["cards"]["card_no"])
+    faces = {}
+
+    for card_no, name in document["deck"].items():
+        if int(card_no) not in used:
+            continue
+
+        path = os.path.join(folder, name)
+
+        if not os.path.exists(path):
+            raise FileNotFoundError("Card " + card_no + " of the document is " + name + ", which is not in " + folder)
+
+        faces[int(card_no)] = Image.open(path).convert("RGBA")
+
+    missing = used - set(faces)
+
+    if missing:
+        raise ValueError("Document deck has no file for cards " + ", ".join(str(card_no) for card_no in sorted(missing)))
+
+    return faces
+
+def cardBounds(population, card_size, scale): #rotated bounding boxes (x0, y0, x1, y1) of cards in output pixels
+    card_w, card_h = card_size
+
+    w = card_w * population["scale"].astype(np.float64)
+    h = card_h * population["scale"].astype(np.float64)
+    angle = np.radians(population["rotation"].astype(np.float64))
+
+    rotated_w = np.abs(w * np.cos(angle)) + np.abs(h * np.sin(angle))
+    rotated_h = np.abs(w * np.sin(angle)) + np.abs(h * np.cos(angle))
+
+    x0 = population["x"] * scale
+    y0 = population["y"] * scale
+
+    return np.stack((x0, y0, x0 + rotated_w * scale, y0 + rotated_h * scale), axis=1)
+
+def cardAffine(card, face_size, card_size, scale, origin): #PIL affine data mapping output pixels (from origin) to card face pixels
+    face_w, face_h = face_size
+    w = card_size[0] * float(card["scale"])
+    h = card_size[1] * float(card["scale"])
+
+    angle = np.radians(float(card["rotation"]))
+    cos = np.cos(angle)
+    sin = np.sin(angle)
+
+    #card centre on canvas (card is placed by top left corner of its rotated bounding box)
+    cx = float(card["x"]) + (abs(w * cos) + abs(h * sin)) / 2
+    cy = float(card["y"]) + (abs(w * sin) + abs(h * cos)) / 2
+
+    #output pixel -> canvas -> unrotated card (PIL rotates counter clockwise) -> face
+    kx = face_w / w
+    ky = face_h / h
+    ox = origin[0] / scale - cx
+    oy = origin[1] / scale - cy
+
+    return (kx * cos / scale, -kx * sin / scale, kx * (cos * ox - sin * oy + w / 2),
+            ky * sin / scale, ky * cos / scale, ky * (sin * ox + cos * oy + h / 2))
+
+def renderTile(tile, tile_origin, cards, faces, card_size, scale): #pasting cards (in order) on RGBA tile image
+    for card in cards:
+        bounds = cardBounds(card.reshape(1), card_size, scale)[0]
+
+        #part of the tile covered by the card
+        x0 = max(0, int(np.floor(bounds[0])) - tile_origin[0])
+        y0 = max(0, int(np.floor(bounds[1])) - tile_origin[1])
+        x1 = min(tile.width, int(np.ceil(bounds[2])) - tile_origin[0])
+        y1 = min(tile.height, int(np.ceil(bounds[3])) - tile_origin[1])
+
+        if x1 <= x0 or y1 <= y0:
+            continue
+
+        face = faces[int(card["card_no"])]
+        data = cardAffine(card, face.size, card_size, scale, (tile_origin[0] + x0, tile_origin[1] + y0))
+
+        patch = face.transform((x1 - x0, y1 - y0), Image.AFFINE, data, resample=Image.BICUBIC)
+
+        #tint like applyTint, blend of rgb toward tint colour
+        arr = np.asarray(patch, dtype=np.float32)
+        tint = np.asarray(card["tint"], dtype=np.float32)
+        arr[:, :, :3] += float(card["tint_power"]) * (tint - arr[:, :, :3])
+
+        patch = Image.fromarray(np.clip(np.rint(arr), 0, 255).astype(np.uint8), "RGBA")
+        tile.paste(patch, (x0, y0), patch)
+
+def renderDocument(document, card_images, out_path, scale=1.0, tile_size=TILE_SIZE, progress=None): #rendering document at scale into .npy or .png file
+    canvas_w, canvas_h = document["canvas"]
+    card_size = document["card_size"]
+
+    width = max(1, int(round(canvas_w * scale)))
+    height = max(1, int(round(canvas_h * scale)))
+
+    population = Genome.populationFromLists(document["cards"])
+    bounds = cardBounds(population, card_size, scale)
+
+    faces = {card_no: img if img.mode == "RGBA" else img.convert("RGBA") for card_no, img in card_images.items()}
+
+    to_png = not out_path.lower().endswith(".npy")
+    array_path = out_path + ".tmp.npy" if to_png else out_path
+
+    output = np.lib.format.open_memmap(array_path, mode="w+", dtype=np.uint8, shape=(height, width, 4))
+
+    tiles = [(tx, ty) for ty in range(0, height, tile_size) for tx in range(0, width, tile_size)]
+
+    for n, (tx, ty) in enumerate(tiles):
+        tw = min(tile_size, width - tx)
+        th = min(tile_size, height - ty)
+
+        #culling cards by rotated bounding box
+        hit = (bounds[:, 0] < tx + tw) & (bounds[:, 2] > tx) & (bounds[:, 1] < ty + th) & (bounds[:, 3] > ty)
+
+        tile = Image.new("RGBA", (tw, th), tuple(document["background"]))
+        renderTile(tile, (tx, ty), population[hit], faces, card_size, scale)
+
+        output[ty:ty + th, tx:tx + tw] = np.asarray(tile)
+
+        if progress is not None:
+            progress(n + 1, len(tiles))
+
+    output.flush()
+
+    if to_png:
+        writePng(out_path, output)
+
+        del output
+        os.remove(array_path)
+
+    return width, height
+
+def pngChunk(f, tag, data): #writing one PNG chunk (length, tag, data, crc)
+    f.write(struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xffffffff))
+
+def filterRows(arr): #PNG scanlines of HxWxC uint8 array with "sub" filter, as bytes
+    height, width, channels = arr.shape
+    rows = np.asarray(arr).reshape(height, width * channels)
+
+    #every byte minus same byte of pixel on the left
+    filtered = rows.copy()
+    filtered[:, channels:] -= rows[:, :-channels]
+
+    return np.concatenate((np.ones((height, 1), dtype=np.uint8), filtered), axis=1).tobytes()
+
+def writePng(path, arr, band_rows=PNG_BAND_ROWS, compress_level=6): #streaming PNG encoder for (memory-mapped) HxWx3/4 uint8 array
+    height, width, channels = arr.shape
+    color_type = 6 if channels == 4 else 2
+
+    compressor = zlib.compressobj(compress_level)
+
+    with open(path + ".tmp", "wb") as f:
+        f.write(b"\x89PNG\r\n\x1a\n")
+        pngChunk(f, b"IHDR", struct.pack(">IIBBBBB", width, height, 8, color_type, 0, 0, 0))
+
+        for y in range(0, height, band_rows):
+            compressed = compressor.compress(filterRows(arr[y:y + band_rows]))
+
+            if compressed:
+                pngChunk(f, b"IDAT", compressed)
+
+        pngChunk(f, b"IDAT", compressor.flush())
+        pngChunk(f, b"IEND", b"")
+
+    os.replace(path + ".tmp", path)
+
+def main():
+    parser = argparse.ArgumentParser(description="Export for Image Recreation Using Cards")
+    parser.add_argument("document", help="genome document (cards.json in results folder)")
+    parser.add_argument("output", help=".png or .npy file")
+    parser.add_argument("--scale", type=float, default=1.0, help="output size relative to target")
+    parser.add_argument("--tile", type=int, default=TILE_SIZE, help="tile side in pixels")
+    parser.add_argument("--deck", default=None, help="folder with the card files named in the document (default = DECK_FOLDER of Main.py)")
+
+    args = parser.parse_args()
+
+    import Main
+
+    document = readDocument(args.document)
+    faces = deckFaces(document, args.deck if args.deck else Main.DECK_FOLDER) #faces the cards were evolved with, not the current deck list
+
+    def progress(done, total):
+        print("\rTile " + str(done) + "/" + str(total), end="", flush=True)
+
+    width, height = renderDocument(document, faces, args.output, args.scale, args.tile, progress)
+
+    print("\nRendered " + str(len(document["cards"]["card_no"])) + " cards at " + str(width) + "x" + str(height) + " into " + args.output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+# Fast SSIM for Image Recreation Using Cards
+# Same metric as skimage.metrics.structural_similarity with its defaults
+# (7x7 uniform window, sample covariance, K1 = 0.01, K2 = 0.03), built on
+# integral images. Target statistics are computed once per run and the
+# per-window SSIM map of the committed canvas is kept, so a candidate only
+# recomputes the windows its card touches.
+#
+# Running this file compares the results against skimage.
+
+import numpy as np
+
+WIN_SIZE = 7
+K1 = 0.01
+K2 = 0.03
+
+#max allowed absolute difference from skimage
+TOLERANCE = 1e-5
+
+def windowMeans(arr, win_size=WIN_SIZE): #mean of every full win_size x win_size window over the last two axes (integral image)
+    h, w = arr.shape[-2:]
+
+    #float64 sums, float32 runs out of precision on big canvases
+    integral = np.zeros(arr.shape[:-2] + (h + 1, w + 1), dtype=np.float64)
+    np.cumsum(arr, axis=-2, dtype=np.float64, out=integral[..., 1:, 1:])
+    np.cumsum(integral[..., 1:, 1:], axis=-1, out=integral[..., 1:, 1:])
+
+    sums = (integral[..., win_size:, win_size:] - integral[..., :-win_size, win_size:]
+            - integral[..., win_size:, :-win_size] + integral[..., :-win_size, :-win_size])
+
+    return sums / (win_size * win_size)
+
+class FastSSIM:
+    def __init__(self, target_gray, data_range=255, win_size=WIN_SIZE):
+        target = np.asarray(target_gray, dtype=np.float64)
+        h, w = target.shape
+
+        if min(h, w) < win_size:
+            raise ValueError("Canvas is smaller than SSIM window, lower the simplification")
+
+        self.win_size = win_size
+        self.cov_norm = win_size * win_size / (win_size * win_size - 1.0)
+        self.c1 = (K1 * data_range) ** 2
+        self.c2 = (K2 * data_range) ** 2
+
+        self.target = target
+
+        #target statistics, computed once
+        self.uy = windowMeans(target, win_size)
+        self.vy = self.cov_norm * (windowMeans(target * target, win_size) - self.uy * self.uy)
+
+        self.window_count = self.uy.size
+
+        self.s_map = np.empty_like(self.uy) #ssim of every window of the committed canvas
+        self.s_total = 0.0
+
+    @classmethod
+    def attach(cls, arrays, data_range=255, win_size=WIN_SIZE): #ssim over existing state arrays (e.g. shared memory), nothing is recomputed
+        fast = cls.__new__(cls)
+
+        fast.win_size = win_size
+        fast.cov_norm = win_size * win_size / (win_size * win_size - 1.0)
+        fast.c1 = (K1 * data_range) ** 2
+        fast.c2 = (K2 * data_range) ** 2
+
+        fast.s_total = 0.0
+        fast.rebind(arrays)
+
+        return fast
+
+    def rebind(self, arrays): #switching to other state arrays with the same content
+        self.target = arrays["ssim_target"]
+        self.uy = arrays["ssim_uy"]
+        self.vy = arrays["ssim_vy"]
+        self.s_map = arrays["ssim_s_map"]
+
+        self.window_count = self.uy.size
+
+    def arrays(self): #named arrays holding the ssim state
+        return {
+            "ssim_target": self.target,
+            "ssim_uy": self.uy,
+            "ssim_vy": self.vy,
+            "ssim_s_map": self.s_map
+        }
+
+    def windowBox(self, box): #windows touched by a change inside box
+        x0, y0, x1, y1 = box
+        rows, cols = self.uy.shape
+
+        wx0 = max(0, x0 - self.win_size + 1)
+        wy0 = max(0, y0 - self.win_size + 1)
+        wx1 = min(cols, x1)
+        wy1 = min(rows, y1)
+
+        return wx0, wy0, wx1, wy1
+
+    def ssimMap(self, x, y, uy, vy): #ssim of every window of plane x against target plane y (planes can be stacked)
+        x = np.asarray(x, dtype=np.float64)
+
+        ux = windowMeans(x, self.win_size)
+        vx = self.cov_norm * (windowMeans(x * x, self.win_size) - ux * ux)
+        uxy = windowMeans(x * y, self.win_size)
+
+        vxy = self.cov_norm * (uxy - ux * uy)
+
+        a1 = 2 * ux * uy + self.c1
+        a2 = 2 * vxy + self.c2
+        b1 = ux * ux + uy * uy + self.c1
+        b2 = vx + vy + self.c2
+
+        return (a1 * a2) / (b1 * b2)
+
+    def _windowSSIM(self, gray, window_box): #ssim of windows in window_box, gray is the plane those windows read
+        wx0, wy0, wx1, wy1 = window_box
+
+        y = self.target[wy0:wy1 + self.win_size - 1, wx0:wx1 + self.win_size - 1]
+
+        return self.ssimMap(gray, y, self.uy[wy0:wy1, wx0:wx1], self.vy[wy0:wy1, wx0:wx1])
+
+    def reset(self, gray): #computing ssim map of whole committed canvas
+        rows, cols = self.uy.shape
+
+        self.s_map[:] = self._windowSSIM(gray, (0, 0, cols, rows))
+        self.s_total = float(self.s_map.sum())
+
+    def mean(self): #mean ssim of committed canvas
+        return self.s_total / self.window_count
+
+    def score(self, gray, box, patch_gray): #mean ssim of committed gray with patch_gray placed in box
+        if box is None:
+            return self.mean()
+
+        wx0, wy0, wx1, wy1 = self.windowBox(box)
+
+        if wx0 >= wx1 or wy0 >= wy1:
+            return self.mean()
+
+        #committed gray around the change (window padded) with candidate patch inside
+        region = gray[wy0:wy1 + self.win_size - 1, wx0:wx1 + self.win_size - 1].astype(np.float64)
+
+        x0, y0, x1, y1 = box
+        region[y0 - wy0:y1 - wy0, x0 - wx0:x1 - wx0] = patch_gray
+
+        new_sum = float(self._windowSSIM(region, (wx0, wy0, wx1, wy1)).sum())
+        old_sum = float(self.s_map[wy0:wy1, wx0:wx1].sum())
+
+        return (self.s_total - old_sum + new_sum) / self.window_count
+
+    def commit(self, gray, box): #updating ssim map after committed gray changed inside box
+        wx0, wy0, wx1, wy1 = self.windowBox(box)
+
+        if wx0 >= wx1 or wy0 >= wy1:
+            return
+
+        region = gray[wy0:wy1 + self.win_size - 1, wx0:wx1 + self.win_size - 1]
+
+        self.s_map[wy0:wy1, wx0:wx1] = self._windowSSIM(region, (wx0, wy0, wx1, wy1))
+        self.s_total = float(self.s_map.sum()) #full resum, so rounding errors do not pile up
+
+def checkAgainstSkimage(trials=50, seed=0): #max difference from skimage over random canvases and card updates
+    from skimage.metrics import structural_similarity as ssim
+
+    rng = np.random.default_rng(seed)
+    worst = 0.0
+
+    for shape in [(7, 7), (45, 80), (180, 320)]:
+        target = rng.uniform(0, 255, shape)
+        gray = rng.uniform(0, 255, shape)
+
+        fast = FastSSIM(target)
+        fast.reset(gray)
+
+        worst = max(worst, abs(fast.mean() - ssim(target, gray, data_range=255)))
+
+        for _ in range(trials):
+            h = int(rng.integers(1, shape[0] + 1))
+            w = int(rng.integers(1, shape[1] + 1))
+            y0 = int(rng.integers(0, shape[0] - h + 1))
+            x0 = int(rng.integers(0, shape[1] - w + 1))
+            box = (x0, y0, x0 + w, y0 + h)
+
+            patch = rng.uniform(0, 255, (h, w))
+
+            cand = gray.copy()
+            cand[y0:y0 + h, x0:x0 + w] = patch
+
+            worst = max(worst, abs(fast.score(gray, box, patch) - ssim(target, cand, data_range=255)))
+
+            if rng.random() < 0.5: #committing some of the patches
+                gray = cand
+                fast.commit(gray, box)
+
+                worst = max(worst, abs(fast.mean() - ssim(target, gray, data_range=255)))
+
+    return worst
+
+if __name__ == "__main__":
+    worst = checkAgainstSkimage()
+
+    print("Max difference from skimage: " + f"{worst:.3e}" + " (tolerance " + f"{TOLERANCE:.0e}" + ")")
+
+    if worst > TOLERANCE:
+        raise SystemExit(1)
@@ -0,0 +1,178 @@
+# Frame sinks for Image Recreation Using Cards
+# Progress frames (copies of the canvas every SNAPSHOT_EVERY loops) go to
+# one or more sinks, every sink has write(image, index) and close():
+#   PngFileSink - temp_save<n>.png files through SnapshotWriter (as before)
+#   ApngSink    - one animated PNG, every frame stores only the rectangle
+#                 that changed since the previous frame
+#   PipeSink    - raw RGB frames into stdin of an encoder process, e.g.
+#                 ffmpeg -f rawvideo -pix_fmt rgb24 -s {width}x{height} -r 30 -i - timelapse.mp4
+# ApngSink and PipeSink encode synchronously, SinkThread runs them on a
+# background thread so the loop does not wait for them.
+
+import os
+import queue
+import struct
+import subprocess
+import threading
+import zlib
+
+import numpy as np
+
+from Export import filterRows, pngChunk
+
+class PngFileSink: #frame per PNG file, written by SnapshotWriter
+    def __init__(self, writer, folder, prefix="temp_save"):
+        self.writer = writer
+        self.folder = folder
+        self.prefix = prefix
+
+    @property
+    def errors(self): #(path, exception) of snapshots the writer failed to save
+        return self.writer.errors
+
+    def write(self, image, index):
+        self.writer.submit(image, os.path.join(self.folder, self.prefix + str(index) + ".png"), index)
+
+    def close(self):
+        self.writer.close()
+
+class ApngSink: #animated PNG, frame count is written when sink is closed
+    def __init__(self, path, fps=10, compress_level=1):
+        self.path = path
+        self.fps = fps
+        self.compress_level = compress_level
+
+        self.frames = 0
+        self._file = None
+        self._actl_offset = 0
+        self._sequence = 0 #fcTL and fdAT chunks share one sequence
+        self._previous = None
+
+    def _start(self, arr): #header and placeholder frame count, once size of frames is known
+        folder = os.path.dirname(self.path)
+
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+
+        height, width, channels = arr.shape
+
+        self._file = open(self.path + ".tmp", "wb")
+        self._file.write(b"\x89PNG\r\n\x1a\n")
+        pngChunk(self._file, b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 6 if channels == 4 else 2, 0, 0, 0))
+
+        self._actl_offset = self._file.tell()
+        pngChunk(self._file, b"acTL", struct.pack(">II", 0, 0)) #frames, plays (0 = loop forever)
+
+    def write(self, image, index):
+        arr = np.asarray(image)
+
+        if self._file is None:
+            self._start(arr)
+            box = (0, 0, arr.shape[1], arr.shape[0]) #first frame is the whole image
+        else:
+            if arr.shape[2] == 4: #whole pixels compared as 32-bit words
+                changed = arr.view(np.uint32)[:, :, 0] != self._previous.view(np.uint32)[:, :, 0]
+            else:
+                changed = np.any(arr != self._previous, axis=2)
+
+            if not changed.any(): #same frame, previous one is shown longer
+                return
+
+            ys = np.flatnonzero(changed.any(axis=1))
+            xs = np.flatnonzero(changed.any(axis=0))
+            box = (int(xs[0]), int(ys[0]), int(xs[-1]) + 1, int(ys[-1]) + 1)
+
+        x0, y0, x1, y1 = box
+        data = zlib.compress(filterRows(arr[y0:y1, x0:x1]), self.compress_level)
+
+        #region replaces pixels of previous frame (dispose none, blend source)
+        pngChunk(self._file, b"fcTL", struct.pack(">IIIIIHHBB", self._sequence, x1 - x0, y1 - y0, x0, y0, 1, self.fps, 0, 0))
+        self._sequence += 1
+
+        if self.frames == 0:
+            pngChunk(self._file, b"IDAT", data)
+        else:
+            pngChunk(self._file, b"fdAT", struct.pack(">I", self._sequence) + data)
+            self._sequence += 1
+
+        self.frames += 1
+        self._previous = arr
+
+    def close(self):
+        if self._file is None:
+            return
+
+        pngChunk(self._file, b"IEND", b"")
+
+        self._file.seek(self._actl_offset)
+        pngChunk(self._file, b"acTL", struct.pack(">II", self.frames, 0))
+
+        self._file.close()
+        self._file = None
+
+        os.replace(self.path + ".tmp", self.path)
+
+class PipeSink: #raw RGB24 frames into stdin of a process, {width} and {height} in command are replaced by frame size
+    def __init__(self, command, size):
+        width, height = size
+
+        self.command = [part.format(width=width, height=height) for part in command]
+        self.frames = 0
+
+        self._process = subprocess.Popen(self.command, stdin=subprocess.PIPE)
+
+    def write(self, image, index):
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+
+        self._process.stdin.write(image.tobytes())
+        self.frames += 1
+
+    def close(self):
+        try:
+            self._process.stdin.close()
+        except OSError: #process already ended
+            pass
+
+        self._process.wait()
+
+class SinkThread: #running synchronous sinks on a background thread with bounded queue
+    def __init__(self, sinks, queue_size=4):
+        self.sinks = list(sinks)
+        self.errors = []
+
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def write(self, image, index): #image must not be changed afterwards (pass a copy)
+        self._queue.put((image, index))
+
+    def close(self): #waiting for queued frames, then closing every sink
+        self._queue.put(None)
+        self._thread.join()
+
+        for sink in self.sinks:
+            try:
+                sink.close()
+            except Exception as e:
+                self.errors.append((type(sink).__name__, e))
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+
+            if job is None:
+                return
+
+            for sink in list(self.sinks):
+                try:
+                    sink.write(*job)
+                except Exception as e: #failed sink gets no more frames, others go on
+                    self.errors.append((type(sink).__name__, e))
+                    self.sinks.remove(sink)
+
+                    try:
+                        sink.close()
+                    except Exception:
+                        pass
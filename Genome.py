@@ -0,0 +1,89 @@
+# Genome for Image Recreation Using Cards
+# Whole population of cards lives in one structured NumPy array. Creation,
+# mutation, clamping and selection run as array operations on a seeded
+# numpy.random.Generator instead of one dict and one random call at a time.
+# Arrays are also cheap to pickle for scoring processes.
+
+import numpy as np
+
+GENOME_DTYPE = np.dtype([
+    ("card_no", np.int16),
+    ("rotation", np.float32),
+    ("scale", np.float32),
+    ("x", np.int32),
+    ("y", np.int32),
+    ("tint", np.uint8, (3,)),
+    ("tint_power", np.float32)
+])
+
+def clampPositions(population, canvas_size, card_size): #clamp card positions in place (rotation is not taken into an account)
+    canvas_w, canvas_h = canvas_size
+    card_w, card_h = card_size
+
+    w = card_w * population["scale"]
+    h = card_h * population["scale"]
+
+    x = np.maximum(-10, np.minimum(canvas_w - w, population["x"]))
+    y = np.maximum(-10, np.minimum(canvas_h - h, population["y"]))
+
+    population["x"] = x.astype(np.int32) #truncating like int()
+    population["y"] = y.astype(np.int32)
+
+    return population
+
+def randomPopulation(rng, count, card_count, canvas_size, card_size, scale_range, tint_power_range): #count of random cards
+    canvas_w, canvas_h = canvas_size
+    card_w, card_h = card_size
+
+    population = np.empty(count, dtype=GENOME_DTYPE)
+
+    population["card_no"] = rng.integers(1, card_count + 1, count)
+    population["rotation"] = rng.uniform(-360, 0, count)
+    population["scale"] = rng.uniform(scale_range[0], scale_range[1], count)
+    population["x"] = rng.integers(-card_w, canvas_w, count)
+    population["y"] = rng.integers(-card_h, canvas_h, count)
+    population["tint"] = rng.integers(0, 255, (count, 3))
+    population["tint_power"] = rng.uniform(tint_power_range[0], tint_power_range[1], count)
+
+    return clampPositions(population, canvas_size, card_size)
+
+def mutatePopulation(rng, parents, count, card_count, canvas_size, card_size, scale_range, tint_power_range,
+                     card_probability, size_power, rotation_power, position_power, color_power, tint_power): #count of mutated children per parent (children of a parent are next to each other)
+    children = np.repeat(parents, count)
+    n = len(children)
+
+    #changing card value (number)
+    change = rng.random(n) < card_probability
+    steps = rng.choice(np.array([-1, 1], dtype=np.int16), n)
+    children["card_no"] = np.where(change, np.clip(children["card_no"] + steps, 1, card_count), children["card_no"])
+
+    children["scale"] = np.clip(children["scale"] + rng.uniform(-size_power, size_power, n), scale_range[0], scale_range[1])
+    children["rotation"] += rng.integers(-rotation_power, rotation_power, n)
+    children["x"] += rng.integers(-position_power, position_power, n)
+    children["y"] += rng.integers(-position_power, position_power, n)
+
+    #changing tint and tint power (power 0 leaves it as it is)
+    if color_power > 0:
+        tint = children["tint"].astype(np.int32) + rng.integers(-color_power, color_power, (n, 3))
+        children["tint"] = np.clip(tint, 0, 255)
+
+    children["tint_power"] = np.clip(children["tint_power"] + rng.uniform(-tint_power, tint_power, n),
+                                     tint_power_range[0], tint_power_range[1])
+
+    return clampPositions(children, canvas_size, card_size)
+
+def selectTop(population, scores, count): #best count cards (best first) and their scores
+    order = np.argsort(-np.asarray(scores), kind="stable")[:count]
+
+    return population[order], np.asarray(scores)[order]
+
+def populationToLists(population): #population as {field: list} (JSON friendly)
+    return {name: population[name].tolist() for name in GENOME_DTYPE.names}
+
+def populationFromLists(fields): #population from {field: list}
+    population = np.empty(len(fields["card_no"]), dtype=GENOME_DTYPE)
+
+    for name in GENOME_DTYPE.names:
+        population[name] = np.asarray(fields[name]).reshape(population[name].shape)
+
+    return population
@@ -8,14 +8,33 @@
 #
 # Author: Andrii Senyk
 # File: Main evolution loop (generation, scoring, and selection).
+#
+# Settings below are defaults, every run is an EvolutionSession with its own
+# copy of them, its own target, canvases and random generator, so several
+# sessions can run in one process and share a Deck and a thread pool.
 
+import cProfile
+import os
+import threading
 from PIL import Image
-import random
 import numpy as np
-from skimage.metrics import structural_similarity as ssim
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from CardDeck import cards
+from SpriteCache import SpriteCache
+from ScoreEngine import ScoreEngine
+from ScorePool import ScorePool
+import Genome
+import Sampler
+from SnapshotWriter import SnapshotWriter
+from FrameSinks import PngFileSink, ApngSink, PipeSink, SinkThread
+from CardIndex import CardIndex
+from DeckAtlas import DeckAtlas
+from SpriteDiskCache import SpriteDiskCache, deckHash
+from Checkpoint import writeCheckpoint, readCheckpoint, rngState, restoreRng
+import Export
+from Preview import previewScale
+from Stats import Stats, appendTrace
 
 #Card values
 CARD_STANDART_WIDTH = 200
@@ -39,6 +58,51 @@ SCORE_CANVAS_HEIGHT = 180
 
 TARGET_PATH = "target.png"
 
+#deck folder, packed atlas in it (python CreateDeckList.py --atlas) is used instead of PNGs when up to date
+DECK_FOLDER = "Deck"
+USE_DECK_ATLAS = True
+
+#progress snapshots, written on a background thread
+RESULTS_FOLDER = "Results"
+SHOW_RESULT = True #opening result in image viewer at the end
+SNAPSHOT_EVERY = 5
+SNAPSHOT_QUEUE_SIZE = 4
+SNAPSHOT_COMPRESS_LEVEL = 1 #PNG zlib level 0-9, low is fast
+SNAPSHOT_KEEP_LAST = None #newest snapshots kept on disk (None = all)
+SNAPSHOT_KEEP_EVERY = None #every n-th snapshot is kept anyway (None = no exceptions)
+#snapshots go to every sink of SNAPSHOT_SINKS (FrameSinks.py), with longest side SNAPSHOT_SIZE (0 = full canvas):
+#"png" - temp_save<n>.png files in RESULTS_FOLDER
+#"apng" - one animated PNG, SNAPSHOT_APNG_FILE in RESULTS_FOLDER
+#"pipe" - raw RGB frames to stdin of SNAPSHOT_PIPE_COMMAND, {width} and {height} are replaced by frame size, e.g.
+#("ffmpeg", "-y", "-f", "rawvideo", "-pix_fmt", "rgb24", "-s", "{width}x{height}", "-r", "30", "-i", "-", "timelapse.mp4")
+SNAPSHOT_SINKS = ("png",)
+SNAPSHOT_SIZE = 0
+SNAPSHOT_APNG_FILE = "timelapse.png"
+SNAPSHOT_APNG_FPS = 10
+SNAPSHOT_PIPE_COMMAND = None
+#failed snapshots (sink or disk errors) are reported once the run ends as progress_callback(..., event="snapshot_failed",
+#errors=[text]), without progress_callback the run raises RuntimeError after result.png and cards.json are saved
+
+#in-memory preview (Preview.py), small canvas with longest side PREVIEW_SIZE gets every accepted card (0 = off),
+#a copy of it goes to session.preview every PREVIEW_EVERY loops
+PREVIEW_SIZE = 480
+PREVIEW_EVERY = 1
+
+#checkpoint (cards, settings, random state) written every CHECKPOINT_EVERY loops and when run ends (0 = off),
+#EvolutionSession.resume(path) continues from it
+CHECKPOINT_EVERY = 25
+CHECKPOINT_FILE = "checkpoint.json" #inside RESULTS_FOLDER
+
+#accepted cards saved next to result.png when run ends, python Export.py renders them at any size
+DOCUMENT_FILE = "cards.json"
+
+#time per stage and counters of the run (Stats.py) are sent as progress_callback(..., stats=dict)
+#every STATS_EVERY loops (0 = off) and appended to STATS_TRACE_FILE as JSON lines (None = no trace)
+STATS_EVERY = 1
+STATS_TRACE_FILE = None
+#loop profiled with cProfile, saved as RESULTS_FOLDER/profile_loop<n>.prof (0 = off)
+PROFILE_LOOP = 0
+
 #cards mutation settings, must follow the rule:
 #CARDS_WINNERS_COUNT * (CARDS_MUTATIONS_COUNT + 1) = CARDS_TOTAL_COUNT
 CARDS_MUTATIONS_COUNT = 4
@@ -49,11 +113,32 @@ GENERATIONS_PER_LOOP = 20
 
 MAX_LOOP_COUNT = 2000
 
-#threading settings, must follow the rule:
-#SCORE_WORKERS * SCORE_CHUNK = CARDS_TOTAL_COUNT
+#early stopping, reported through progress_callback as event
+#loop ends early ("plateau") when best score moved less than GENERATION_EPSILON for GENERATION_PATIENCE generations (0 = off)
+GENERATION_PATIENCE = 5
+GENERATION_EPSILON = 1e-5
+#card that does not improve committed canvas is not placed, loop is retried up to COMMIT_RETRIES times ("rejected")
+REJECT_NON_IMPROVING = True
+COMMIT_RETRIES = 2
+#run ends ("converged") when mean improvement per loop over last LOOP_PATIENCE loops is below LOOP_MIN_IMPROVEMENT (0 = off)
+LOOP_PATIENCE = 50
+LOOP_MIN_IMPROVEMENT = 1e-5
+
+#scoring settings, backend is one of:
+#"batch" - stacked NumPy batches on the evolution thread
+#"threads" - chunks of SCORE_CHUNK cards scored by SCORE_WORKERS threads
+#"processes" - chunks of SCORE_CHUNK cards scored by SCORE_WORKERS processes (shared memory canvas)
+SCORE_BACKEND = "batch"
 SCORE_WORKERS = 5
 SCORE_CHUNK = 20
 
+#coarse-to-fine screening, candidates are scored at IMAGE_SIMPLIFICATION * factor first
+#and only the best PYRAMID_KEEP_FRACTION goes on to the next (finer) level,
+#factors below 1 re-score survivors finer than working resolution
+USE_PYRAMID = False
+PYRAMID_FACTORS = (4,)
+PYRAMID_KEEP_FRACTION = 0.25
+
 #power of mutations per new generation
 MUTATE_CARD_PROBABILITY = 0.35
 MUTATE_SIZE_POWER = 0.15
@@ -66,68 +151,68 @@ MUTATE_TINT_POWER = 0.03
 TINT_POWER_MIN = 0.7
 TINT_POWER_MAX = 0.9
 
+#new cards are placed where canvas differs from target the most (residual),
+#RESIDUAL_SAMPLING_FRACTION of new cards is sampled that way, rest stays uniform
+USE_RESIDUAL_SAMPLING = False
+RESIDUAL_SAMPLING_FRACTION = 0.8
+
+#tint and tint power are solved (least squares on color) for every candidate's geometry before scoring,
+#mutation then only searches card number, scale, rotation and position
+SOLVE_TINT = False
+
+#card faces of new and mutated cards are picked by how well they match target under the card
+#(random one of CARD_INDEX_TOP_K nearest faces), instead of uniformly / by +-1 step
+USE_CARD_INDEX = False
+CARD_INDEX_TOP_K = 3
+
+#(x0, y0, x1, y1) on canvas, candidates whose centre is outside get no fitness (None = whole canvas),
+#tiled runs (Tiles.py) use it so every card belongs to exactly one tile
+CARD_CENTER_BOX = None
+
+#(x0, y0, x1, y1) on canvas, candidates whose rotated bounding box goes outside get no fitness (None = no limit,
+#inf sides are open), tiled runs use it so cards stay inside the part of the target they were scored against
+CARD_BOUNDS_BOX = None
+
+#island mode (ISLANDS > 1): every loop evolves ISLANDS populations at once, one per scoring process
+#(working level only, no pyramid), island i multiplies mutation powers by ISLAND_MUTATION_SCALES[i] (repeated
+#when shorter), every ISLAND_MIGRATE_EVERY generations best ISLAND_MIGRANTS cards of every island replace
+#the worst winners of the next one, best card of all islands is placed
+ISLANDS = 0
+ISLAND_MUTATION_SCALES = (1.0, 0.5, 2.0, 0.25)
+ISLAND_MIGRATE_EVERY = 5
+ISLAND_MIGRANTS = 2
+
+#seed of random generator (None = different every run)
+RANDOM_SEED = None
+
 USE_SSIM = True
 WEIGHT_SSIM = 0.3
 USE_COLOR = True
 WEIGHT_COLOR = 0.7
 
-target_full = None 
-
-target_small = None 
-target_small_arr = None
-target_gray_arr = None
-
-CARD_IMAGES = {}
-SMALL_CANVAS = None
+#sprite cache settings
+SPRITE_CACHE_MAX_MB = 256
+SPRITE_ROTATION_STEP = 2
+#rendered sprites are also kept on disk, shared by runs and processes keyed by deck content (None = off),
+#python SpriteDiskCache.py info/clear/warm manages the folder
+SPRITE_DISK_CACHE_FOLDER = None
+SPRITE_DISK_CACHE_MAX_MB = 1024
 
-BEST_SCORE = 0.0
+#every UPPER_CASE setting above is only a default, each session takes its own copy (EvolutionSession(NAME=value))
+CONFIG_NAMES = tuple(name for name in list(globals()) if name.isupper())
 
-def createRandomCard(): #function for creating random card
-    random_card_no = random.randrange(1, len(cards) + 1)
-    
-    new_card = {
-        "card_no": random_card_no,
-        "rotation": random.uniform(0, -360),
-        "scale": random.uniform(MIN_CARD_SIZE, MAX_CARD_SIZE),
-        "position": (random.randrange(-CARD_STANDART_WIDTH, CANVAS_WIDTH), random.randrange(-CARD_STANDART_HEIGHT, CANVAS_HEIGHT)),
-        "tint": (random.randrange(0, 255), random.randrange(0, 255), random.randrange(0, 255)),
-        "tint_power": random.uniform(TINT_POWER_MIN, TINT_POWER_MAX)
-    }
-    
-    new_card = clampCardPosition(new_card)
-    
-    return new_card
+WORKER_SESSION = None #session of a scoring process (processes backend)
 
-def placeCard(canvas, card): #placing card on canvas
-    base = CARD_IMAGES[card["card_no"]].copy()
+def sessionConfig(**overrides): #current module settings with overrides applied
+    unknown = set(overrides) - set(CONFIG_NAMES)
     
-    img = applyTint(base, card["tint"], card["tint_power"])
+    if unknown:
+        raise TypeError("Unknown settings: " + ", ".join(sorted(unknown)))
     
-    img = img.resize((int(CARD_STANDART_WIDTH * card["scale"]), int(CARD_STANDART_HEIGHT * card["scale"])), Image.LANCZOS)
-    img = img.rotate(card["rotation"], expand=True)
-    
-    canvas.paste(img, card["position"], img)
-
-def placeSmallCard(canvas, card): #placing scaled (down) card on scaled (down) canvas
-    base = CARD_IMAGES[card["card_no"]].copy()
-    
-    img = applyTint(base, card["tint"], card["tint_power"])
-    
-    img = img.resize((int(CARD_SMALL_WIDTH * card["scale"]), int(CARD_SMALL_HEIGHT * card["scale"])), Image.LANCZOS)
-    img = img.rotate(card["rotation"], expand=True)
-    
-    sx = int(card["position"][0] / IMAGE_SIMPLIFICATION)
-    sy = int(card["position"][1] / IMAGE_SIMPLIFICATION)
-    
-    canvas.paste(img, (sx, sy), img)
-    
-def renderOnCanvas(card_list, canvas): #rendering card on canvas (RGB, alpha is ignored)
-    
-    for card in card_list:
-        placeCard(canvas, card)
-    
-    return canvas.convert("RGB")
+    config = {name: globals()[name] for name in CONFIG_NAMES}
+    config.update(overrides)
     
+    return config
 
 def applyTint(img, tint, tint_power): #coloring the cardds with tint
     if img.mode != "RGBA":
@@ -145,192 +230,821 @@ def applyTint(img, tint, tint_power): #coloring the cardds with tint
     
     return blended
 
-def mutateCard(card, return_count=CARDS_MUTATIONS_COUNT): #mutating n cards from 1 card
-    new_cards = []
-    
-    for _ in range(return_count):
-        new_card = {}
+class Deck: #card faces, atlas and sprite caches, one deck can be shared by many sessions
+    def __init__(self, config=None):
+        config = sessionConfig() if config is None else config
+        
+        self.folder = config["DECK_FOLDER"]
+        self.card_files = cards
+        self.card_count = len(cards)
+        
+        self.cache_bytes = int(config["SPRITE_CACHE_MAX_MB"] * 1024 * 1024)
+        self.rotation_step = config["SPRITE_ROTATION_STEP"]
+        self.disk_cache_folder = config["SPRITE_DISK_CACHE_FOLDER"]
+        self.disk_cache_bytes = int(config["SPRITE_DISK_CACHE_MAX_MB"] * 1024 * 1024)
+        
+        #loading card deck, from atlas if there is an up to date one
+        self.atlas = DeckAtlas.open(self.folder, cards) if config["USE_DECK_ATLAS"] else None
+        self.images = {}
         
-        if random.random() < MUTATE_CARD_PROBABILITY: #changing card value (number)
-            new_card_no = max(1, min(card["card_no"] + random.choice([-1, 1]), len(cards)))
+        for id in cards.keys():
+            if self.atlas is not None:
+                self.images[id] = self.atlas.image(id)
+            else:
+                self.images[id] = Image.open(os.path.join(self.folder, cards[id])).convert("RGBA")
+        
+        self.means = Sampler.cardMeanColors(self.images, self.card_count) #mean colour of every card face (residual sampling)
+        self.hash = None #content hash, computed for disk cache
+        
+        self._index = None
+        self._sprites = {}
+        self._lock = threading.Lock()
+    
+    def sprites(self, simplification): #sprite cache shared by sessions of one simplification (disk cache is kept per simplification)
+        with self._lock:
+            cache = self._sprites.get(simplification)
             
-            new_card["card_no"] = new_card_no
-        else:
-            new_card["card_no"] = card["card_no"]
+            if cache is None:
+                cache = SpriteCache(self.images, self.cache_bytes, self.rotation_step)
+                cache.atlas = self.atlas
+                
+                if self.disk_cache_folder is not None: #sprites of atlas and PNGs differ slightly, so source is part of the hash
+                    if self.hash is None:
+                        self.hash = deckHash(self.images, "atlas" if self.atlas is not None else "png")
+                    
+                    cache.disk = SpriteDiskCache(self.disk_cache_folder, self.hash, simplification, self.disk_cache_bytes)
+                
+                self._sprites[simplification] = cache
+            
+            return cache
+    
+    def cardIndex(self): #face descriptors of the deck, built on first use
+        with self._lock:
+            if self._index is None:
+                self._index = CardIndex(self.images)
+            
+            return self._index
+
+class EvolutionSession: #one evolution: settings, target, canvases, random generator and scoring pool
+    def __init__(self, target_path=None, deck=None, pool=None, **settings):
+        for name, value in sessionConfig(**settings).items():
+            setattr(self, name, value)
         
-        new_scale = card["scale"] + random.uniform(-MUTATE_SIZE_POWER, MUTATE_SIZE_POWER) #scaling card
-        new_scale = max(MIN_CARD_SIZE, min(MAX_CARD_SIZE, new_scale))
-        new_card["scale"] = new_scale
+        if target_path is not None:
+            self.TARGET_PATH = target_path
         
-        new_card["rotation"] = card["rotation"] + random.randrange(-MUTATE_ROTATION_POWER, MUTATE_ROTATION_POWER) #changing rotation
-        new_card["position"] = (card["position"][0] + random.randrange(-MUTATE_POSITION_POWER, MUTATE_POSITION_POWER),
-                                card["position"][1] + random.randrange(-MUTATE_POSITION_POWER, MUTATE_POSITION_POWER)) #changing position
+        if self.IMAGE_SIMPLIFICATION < 1:
+            raise ValueError("Image simplification must be at least 1")
         
-        #changing tint
-        r, g, b = card["tint"]
+        self.deck = deck if deck is not None else Deck(self.config())
+        self.shared_pool = pool #executor shared with other sessions ("threads" backend), it is not shut down by session
+        self.pool = None
         
-        r += random.randrange(-MUTATE_COLOR_POWER, MUTATE_COLOR_POWER)
-        g += random.randrange(-MUTATE_COLOR_POWER, MUTATE_COLOR_POWER)
-        b += random.randrange(-MUTATE_COLOR_POWER, MUTATE_COLOR_POWER)
+        self.rng = np.random.default_rng(self.RANDOM_SEED)
+        self.best_score = 0.0
         
-        r = max(0, min(255, r))
-        g = max(0, min(255, g))
-        b = max(0, min(255, b))
+        self.card_list = [] #committed cards
+        self.history = [] #committed fitness after every loop
+        self.loop = 0 #finished loops
+        self.stats = Stats() #time per stage and counters of this session
+        self.preview = None #PreviewSlot receiving frames of preview canvas (None = no preview frames)
+        self.snapshot_errors = [] #failed snapshots of the last run as text
         
-        new_card["tint"] = (r, g, b)
+        self.loadTarget()
+    
+    @classmethod
+    def resume(cls, path, target_path=None, deck=None, pool=None, **settings): #session continuing from checkpoint file, settings override saved ones
+        state = readCheckpoint(path)
+        config = {}
         
-        #changing tint power
-        tint_power = card["tint_power"]
-        tint_power += random.uniform(-MUTATE_TINT_POWER, MUTATE_SIZE_POWER)
-        tint_power = max(TINT_POWER_MIN, min(TINT_POWER_MAX, tint_power))
+        for name, value in state["config"].items():
+            if name not in CONFIG_NAMES: #setting which does not exist anymore
+                continue
+            
+            if isinstance(globals()[name], tuple) and isinstance(value, list): #JSON has no tuples
+                value = tuple(value)
+            
+            config[name] = value
         
-        new_card["tint_power"] = tint_power
+        config.update(settings)
         
-        new_card = clampCardPosition(new_card)
+        session = cls(target_path if target_path is not None else state["target_path"], deck, pool, **config)
+        session.replayCards(Genome.populationFromLists(state["cards"]))
         
-        new_cards.append(new_card)
+        session.rng = restoreRng(state["rng"])
+        session.loop = state["loop"]
+        session.history = state["history"]
+        session.best_score = state["best_score"]
+        
+        return session
     
-    return new_cards
-
-def clampCardPosition(card): #clamp card positon
+    @classmethod
+    def scoringWorker(cls, engine, config): #bare session of a scoring process, it only scores cards against shared engine
+        session = cls.__new__(cls)
+        
+        for name, value in config.items():
+            setattr(session, name, value)
+        
+        session.deck = Deck(config)
+        session.sprites = session.deck.sprites(session.IMAGE_SIMPLIFICATION)
+        session.engine = engine
+        session.stats = Stats() #not reported, stages of scoring processes stay in them
+        
+        #what island populations need besides scoring (rng is seeded per task)
+        session.rng = None
+        session.pyramid_levels = []
+        session.card_index = session.deck.cardIndex().forTarget(engine.target_rgb) if session.USE_CARD_INDEX else None
+        
+        return session
     
-    #> Function needs fixing because rotation is not taken into an account which creates some problems of uneven distribution <#
+    def config(self): #settings of this session
+        return {name: getattr(self, name) for name in CONFIG_NAMES}
     
-    x, y = card["position"]
+    def loadTarget(self): #creating full and small canvas, calculating small cards and canvas size
+        self.target_full = Image.open(self.TARGET_PATH).convert("RGB")
+        
+        self.CANVAS_WIDTH, self.CANVAS_HEIGHT = self.target_full.size
+        self.SCORE_CANVAS_WIDTH = int(self.CANVAS_WIDTH / self.IMAGE_SIMPLIFICATION)
+        self.SCORE_CANVAS_HEIGHT = int(self.CANVAS_HEIGHT / self.IMAGE_SIMPLIFICATION)
+        
+        self.target_small = self.target_full.resize((self.SCORE_CANVAS_WIDTH, self.SCORE_CANVAS_HEIGHT), Image.LANCZOS)
+        self.target_small_arr = np.asarray(self.target_small, dtype=np.float32)
+        
+        self.CARD_SMALL_WIDTH = int(self.CARD_STANDART_WIDTH / self.IMAGE_SIMPLIFICATION)
+        self.CARD_SMALL_HEIGHT = int(self.CARD_STANDART_HEIGHT / self.IMAGE_SIMPLIFICATION)
+        
+        #scaled (down) canvas lives in the score engine as float32 array
+        self.engine = ScoreEngine(self.target_small_arr, self.USE_COLOR, self.WEIGHT_COLOR, self.USE_SSIM, self.WEIGHT_SSIM)
+        self.engine.stats = self.stats
+        
+        self.pyramid_levels = [] #extra levels of pyramid mode (dicts with simplification, card size and engine)
+        
+        if self.USE_PYRAMID and self.ISLANDS <= 1: #extra levels, ones too small for ssim window are skipped (islands score working level only)
+            for factor in sorted(self.PYRAMID_FACTORS, reverse=True):
+                simplification = self.IMAGE_SIMPLIFICATION * factor
+                
+                if factor == 1 or simplification < 1:
+                    continue
+                
+                if min(self.CANVAS_WIDTH, self.CANVAS_HEIGHT) / simplification < 7:
+                    continue
+                
+                self.pyramid_levels.append(self.createLevel(self.target_full, simplification))
+        
+        self.sprites = self.deck.sprites(self.IMAGE_SIMPLIFICATION)
+        
+        #full size canvas gets every accepted card once, snapshots are copies of it
+        self.full_canvas = Image.new("RGBA", (self.CANVAS_WIDTH, self.CANVAS_HEIGHT), self.CANVAS_BACKGROUND)
+        
+        #preview canvas gets the same cards scaled down, so preview cost does not grow with canvas size
+        if self.PREVIEW_SIZE:
+            self.preview_scale = previewScale(self.CANVAS_WIDTH, self.CANVAS_HEIGHT, self.PREVIEW_SIZE)
+            self.preview_canvas = Image.new("RGBA", (max(1, int(self.CANVAS_WIDTH * self.preview_scale)),
+                                                     max(1, int(self.CANVAS_HEIGHT * self.preview_scale))), self.CANVAS_BACKGROUND)
+        else:
+            self.preview_scale = 0.0
+            self.preview_canvas = None
+        
+        #snapshot canvas, scaled down like preview canvas (same one when sizes match), None = full canvas
+        if self.SNAPSHOT_SIZE and self.SNAPSHOT_SIZE == self.PREVIEW_SIZE:
+            self.snapshot_scale = self.preview_scale
+            self.snapshot_canvas = self.preview_canvas
+        elif self.SNAPSHOT_SIZE and previewScale(self.CANVAS_WIDTH, self.CANVAS_HEIGHT, self.SNAPSHOT_SIZE) < 1:
+            self.snapshot_scale = previewScale(self.CANVAS_WIDTH, self.CANVAS_HEIGHT, self.SNAPSHOT_SIZE)
+            self.snapshot_canvas = Image.new("RGBA", (max(1, int(self.CANVAS_WIDTH * self.snapshot_scale)),
+                                                      max(1, int(self.CANVAS_HEIGHT * self.snapshot_scale))), self.CANVAS_BACKGROUND)
+        else:
+            self.snapshot_scale = 1.0
+            self.snapshot_canvas = None
+        
+        if self.USE_CARD_INDEX:
+            self.card_index = self.deck.cardIndex().forTarget(self.target_small_arr)
+        else:
+            self.card_index = None
     
-    w = (CARD_STANDART_WIDTH * card["scale"])
-    h = (CARD_STANDART_HEIGHT * card["scale"])
+    def createRandomCards(self, count): #function for creating array of random cards
+        residual_count = int(count * self.RESIDUAL_SAMPLING_FRACTION) if self.USE_RESIDUAL_SAMPLING else 0
+        
+        uniform_cards = Genome.randomPopulation(self.rng, count - residual_count, self.deck.card_count,
+                                                (self.CANVAS_WIDTH, self.CANVAS_HEIGHT),
+                                                (self.CARD_STANDART_WIDTH, self.CARD_STANDART_HEIGHT),
+                                                (self.MIN_CARD_SIZE, self.MAX_CARD_SIZE), (self.TINT_POWER_MIN, self.TINT_POWER_MAX))
+        
+        if self.card_index is not None and len(uniform_cards):
+            uniform_cards["card_no"] = self.card_index.choose(self.rng, uniform_cards, self.IMAGE_SIMPLIFICATION,
+                                                              (self.CARD_STANDART_WIDTH, self.CARD_STANDART_HEIGHT),
+                                                              self.CARD_INDEX_TOP_K)
+        
+        if residual_count == 0:
+            return uniform_cards
+        
+        residual_cards = Sampler.residualPopulation(self.rng, residual_count, self.engine.error_map, self.engine.target_rgb,
+                                                    self.IMAGE_SIMPLIFICATION, self.deck.means,
+                                                    (self.CANVAS_WIDTH, self.CANVAS_HEIGHT),
+                                                    (self.CARD_STANDART_WIDTH, self.CARD_STANDART_HEIGHT),
+                                                    (self.MIN_CARD_SIZE, self.MAX_CARD_SIZE), (self.TINT_POWER_MIN, self.TINT_POWER_MAX),
+                                                    self.card_index, self.CARD_INDEX_TOP_K)
+        
+        return np.concatenate((residual_cards, uniform_cards))
     
-    x = max(-10, min(CANVAS_WIDTH - w, x))
-    y = max(-10, min(CANVAS_HEIGHT - h, y))
+    def placeCard(self, canvas, card, scale=1.0): #placing card on canvas (scale < 1 for scaled down canvas)
+        width = max(1, int(self.CARD_STANDART_WIDTH * card["scale"] * scale))
+        height = max(1, int(self.CARD_STANDART_HEIGHT * card["scale"] * scale))
+        
+        if scale < 1 and self.deck.atlas is not None: #small card is resampled from nearest mip level
+            base = self.deck.atlas.mip(int(card["card_no"]), width, height)
+        else:
+            base = self.deck.images[int(card["card_no"])].copy()
+        
+        img = applyTint(base, tuple(int(c) for c in card["tint"]), float(card["tint_power"]))
+        
+        img = img.resize((width, height), Image.LANCZOS)
+        img = img.rotate(float(card["rotation"]), expand=True)
+        
+        canvas.paste(img, (int(card["x"] * scale), int(card["y"] * scale)), img)
     
-    card["position"] = (int(x), int(y))
+    def smallSprite(self, card): #scaled (down) tinted sprite and its position on scaled (down) canvas
+        rgb, alpha = self.sprites.getTinted(int(card["card_no"]),
+                                            self.CARD_SMALL_WIDTH * card["scale"], self.CARD_SMALL_HEIGHT * card["scale"],
+                                            card["rotation"], card["tint"], card["tint_power"]) #cached sprite
+        
+        sx = int(card["x"] / self.IMAGE_SIMPLIFICATION)
+        sy = int(card["y"] / self.IMAGE_SIMPLIFICATION)
+        
+        return rgb, alpha, sx, sy
     
-    return card
-
-
-def calculateFitness(card): #calculating fitness of each card on a canvas
-    cand_small = SMALL_CANVAS.copy()
-    placeSmallCard(cand_small, card)
+    def placeSmallCard(self, engine, card): #placing scaled (down) card on scaled (down) canvas
+        engine.commit(*self.smallSprite(card))
     
-    #creating small array of colord/gray canvas
-    cand_small_rgb = cand_small.convert("RGB")
-    cand_small_arr = np.asarray(cand_small_rgb, dtype=np.float32)
-    cand_gray_arr = np.asarray(cand_small.convert("L"), dtype=np.float32)
+    def createLevel(self, target, simplification): #extra pyramid level, target and cards scaled by simplification
+        width = int(target.width / simplification)
+        height = int(target.height / simplification)
+        
+        target_arr = np.asarray(target.resize((width, height), Image.LANCZOS), dtype=np.float32)
+        
+        engine = ScoreEngine(target_arr, self.USE_COLOR, self.WEIGHT_COLOR, self.USE_SSIM, self.WEIGHT_SSIM)
+        engine.stats = self.stats
+        
+        return {
+            "simplification": simplification,
+            "card_width": self.CARD_STANDART_WIDTH / simplification,
+            "card_height": self.CARD_STANDART_HEIGHT / simplification,
+            "engine": engine
+        }
     
-    if USE_SSIM: #using ssim
-        ssim_val = ssim(target_gray_arr, cand_gray_arr, data_range=255)
-    else:
-        ssim_val = 0
-    if USE_COLOR: #using color compereson
-        diff = cand_small_arr - target_small_arr
-        sq = diff ** 2
-        mse = np.mean(sq)
+    def levelSprite(self, card, level): #tinted sprite and its position on canvas of pyramid level
+        rgb, alpha = self.sprites.getTinted(int(card["card_no"]),
+                                            level["card_width"] * card["scale"], level["card_height"] * card["scale"],
+                                            card["rotation"], card["tint"], card["tint_power"])
         
-        color_score = 1.0 / (1.0 + mse / 5000.0)
-    else:
-        color_score = 0
+        sx = int(card["x"] / level["simplification"])
+        sy = int(card["y"] / level["simplification"])
+        
+        return rgb, alpha, sx, sy
     
-    return color_score * WEIGHT_COLOR + ssim_val * WEIGHT_SSIM
-
-def generationLoop(count, progress_callback, stop_event): #Loop of n generations, creates 1 best card to place on canvas
-    global BEST_SCORE
+    def renderOnCanvas(self, card_list, canvas): #rendering card on canvas (RGB, alpha is ignored)
+        
+        for card in card_list:
+            self.placeCard(canvas, card)
+        
+        return canvas.convert("RGB")
     
-    generation_cards = []
+    def mutateCards(self, parents, return_count=None): #mutating n cards from every parent card
+        return_count = self.CARDS_MUTATIONS_COUNT if return_count is None else return_count
+        
+        color_power = 0 if self.SOLVE_TINT else self.MUTATE_COLOR_POWER #solved tint is not searched
+        tint_power = 0 if self.SOLVE_TINT else self.MUTATE_TINT_POWER
+        card_probability = 0 if self.card_index is not None else self.MUTATE_CARD_PROBABILITY #index picks the face below
+        
+        children = Genome.mutatePopulation(self.rng, parents, return_count, self.deck.card_count,
+                                           (self.CANVAS_WIDTH, self.CANVAS_HEIGHT),
+                                           (self.CARD_STANDART_WIDTH, self.CARD_STANDART_HEIGHT),
+                                           (self.MIN_CARD_SIZE, self.MAX_CARD_SIZE), (self.TINT_POWER_MIN, self.TINT_POWER_MAX),
+                                           card_probability, self.MUTATE_SIZE_POWER, self.MUTATE_ROTATION_POWER,
+                                           self.MUTATE_POSITION_POWER, color_power, tint_power)
+        
+        if self.card_index is not None: #changing card face to one matching target under mutated geometry
+            change = self.rng.random(len(children)) < self.MUTATE_CARD_PROBABILITY
+            
+            if change.any():
+                children["card_no"][change] = self.card_index.choose(self.rng, children[change], self.IMAGE_SIMPLIFICATION,
+                                                                     (self.CARD_STANDART_WIDTH, self.CARD_STANDART_HEIGHT),
+                                                                     self.CARD_INDEX_TOP_K)
+        
+        return children
     
-    for _ in range(CARDS_TOTAL_COUNT): #create initial random set of cards
-        generation_cards.append(createRandomCard())
+    def solveTints(self, card_list): #replacing tint and tint power of every card with least-squares solution for its geometry (in place)
+        for i in range(len(card_list)):
+            card = card_list[i]
+            
+            rgb, alpha = self.sprites.getBase(int(card["card_no"]),
+                                              self.CARD_SMALL_WIDTH * card["scale"], self.CARD_SMALL_HEIGHT * card["scale"],
+                                              card["rotation"])
+            
+            solved = self.engine.solveTint(rgb, alpha, int(card["x"] / self.IMAGE_SIMPLIFICATION), int(card["y"] / self.IMAGE_SIMPLIFICATION),
+                                           (self.TINT_POWER_MIN, self.TINT_POWER_MAX))
+            
+            if solved is not None:
+                card_list["tint"][i] = np.round(solved[0])
+                card_list["tint_power"][i] = solved[1]
     
-    for g in range(GENERATIONS_PER_LOOP):
-        if stop_event is not None and stop_event.is_set():
-            return generation_cards[0]
+    def placementMask(self, card_list): #which cards may be placed, centre inside CARD_CENTER_BOX and bounding box inside CARD_BOUNDS_BOX
+        bounds = Export.cardBounds(card_list, (self.CARD_STANDART_WIDTH, self.CARD_STANDART_HEIGHT), 1.0)
+        mask = np.ones(len(card_list), dtype=bool)
         
-        fitness_scores = {}
+        if self.CARD_CENTER_BOX is not None:
+            cx = (bounds[:, 0] + bounds[:, 2]) / 2
+            cy = (bounds[:, 1] + bounds[:, 3]) / 2
+            x0, y0, x1, y1 = self.CARD_CENTER_BOX
+            
+            mask &= (cx >= x0) & (cx < x1) & (cy >= y0) & (cy < y1)
         
-        def _score_one(idx):
-            return idx, calculateFitness(generation_cards[idx])
+        if self.CARD_BOUNDS_BOX is not None:
+            x0, y0, x1, y1 = self.CARD_BOUNDS_BOX
+            
+            mask &= (bounds[:, 0] >= x0) & (bounds[:, 1] >= y0) & (bounds[:, 2] <= x1) & (bounds[:, 3] <= y1)
+        
+        return mask
+    
+    def calculateFitness(self, card): #calculating fitness of each card on a canvas
+        return self.engine.score(*self.smallSprite(card))
+    
+    def calculateFitnessBatch(self, card_list): #calculating fitness of many cards at once, returns array of scores
+        with self.stats.stage("scoring.sprites"):
+            sprites = [self.smallSprite(card) for card in card_list]
+        
+        return self.engine.scoreBatch(sprites)
+    
+    def submitFitnessBatch(self, card_list): #scoring cards in the background pool, returns future of scores
+        if isinstance(self.pool, ScorePool):
+            return self.pool.submit(card_list)
         
-        with ThreadPoolExecutor(max_workers=SCORE_WORKERS) as ex: #do scoring in threads
-            for start in range(0, len(generation_cards), SCORE_CHUNK):
+        return self.pool.submit(self.calculateFitnessBatch, card_list)
+    
+    def startPool(self): #starting scoring pool of the run (or using shared one)
+        if self.ISLANDS > 1 or (self.shared_pool is None and self.SCORE_BACKEND == "processes"): #workers attach to engine state in shared memory, islands always run in them
+            self.pool = ScorePool(self.engine, self.ISLANDS if self.ISLANDS > 1 else self.SCORE_WORKERS,
+                                  {"use_color": self.USE_COLOR, "weight_color": self.WEIGHT_COLOR,
+                                   "use_ssim": self.USE_SSIM, "weight_ssim": self.WEIGHT_SSIM},
+                                  scoreInWorker, setupScoreWorker, (self.config(),))
+            self.engine = self.pool.engine
+            self.engine.stats = self.stats
+        elif self.shared_pool is not None:
+            self.pool = self.shared_pool
+        elif self.SCORE_BACKEND == "threads":
+            self.pool = ThreadPoolExecutor(max_workers=self.SCORE_WORKERS)
+    
+    def closePool(self): #stopping scoring pool of the run, shared pool is left running
+        if self.pool is self.shared_pool:
+            pass
+        elif isinstance(self.pool, ScorePool):
+            self.pool.close()
+        elif self.pool is not None:
+            self.pool.shutdown(wait=True, cancel_futures=True)
+        
+        self.pool = None
+    
+    def scorePopulation(self, generation_cards, stop_event): #fitness of every card at working resolution (None if stopped)
+        fitness_scores = np.full(len(generation_cards), -np.inf)
+        
+        if self.pool is None: #do scoring in vectorized batches
+            for start in range(0, len(generation_cards), self.SCORE_CHUNK):
                 if stop_event is not None and stop_event.is_set():
-                    return generation_cards[0]
+                    return None
                 
-                futures = [
-                    ex.submit(_score_one, i)
-                    for i in range(start, min(start + SCORE_CHUNK, len(generation_cards)))
-                ]
+                fitness_scores[start:start + self.SCORE_CHUNK] = self.calculateFitnessBatch(generation_cards[start:start + self.SCORE_CHUNK])
+        else: #do scoring in threads/processes started once per run
+            futures = {
+                self.submitFitnessBatch(generation_cards[start:start + self.SCORE_CHUNK]): start
+                for start in range(0, len(generation_cards), self.SCORE_CHUNK)
+            }
+            
+            for fut in as_completed(futures):
+                if stop_event is not None and stop_event.is_set():
+                    return None
                 
-                for fut in as_completed(futures):
-                    if stop_event is not None and stop_event.is_set():
-                        return generation_cards[0]
-                    idx, fit = fut.result()
-                    fitness_scores[idx] = fit
+                chunk_scores = fut.result()
+                fitness_scores[futures[fut]:futures[fut] + len(chunk_scores)] = chunk_scores
         
-        sorted_scores = sorted(fitness_scores.items(), key=lambda item: item[1], reverse=True) #sort cards best to worst
+        return fitness_scores
+    
+    def screenPopulation(self, generation_cards, stop_event): #coarse-to-fine scoring, cards dropped on a coarse level get -inf (None if stopped)
+        fitness_scores = np.full(len(generation_cards), -np.inf)
+        survivors = np.arange(len(generation_cards))
         
-        best_100_scores = sorted_scores[:CARDS_WINNERS_COUNT] #taking top n cards
+        coarse = [level for level in self.pyramid_levels if level["simplification"] > self.IMAGE_SIMPLIFICATION]
+        fine = [level for level in self.pyramid_levels if level["simplification"] < self.IMAGE_SIMPLIFICATION]
         
-        best_100_cards = []
+        stages = coarse + [None] + fine #None is the working level
         
-        for k, _ in best_100_scores: #selecting to n from generation cards
-            best_100_cards.append(generation_cards[k])
+        for k, level in enumerate(stages):
+            if stop_event is not None and stop_event.is_set():
+                return None
             
-        generation_cards = best_100_cards.copy()
+            stage_cards = generation_cards[survivors]
+            
+            if level is None:
+                stage_scores = self.scorePopulation(stage_cards, stop_event)
+                
+                if stage_scores is None:
+                    return None
+            else:
+                stage_scores = level["engine"].scoreBatch([self.levelSprite(card, level) for card in stage_cards])
+            
+            if k == len(stages) - 1: #last level gives the fitness
+                fitness_scores[survivors] = stage_scores
+                break
+            
+            keep = max(self.CARDS_WINNERS_COUNT, int(np.ceil(len(survivors) * self.PYRAMID_KEEP_FRACTION)))
+            survivors = survivors[np.argsort(-stage_scores, kind="stable")[:keep]]
         
-        BEST_SCORE = best_100_scores[0][1]
+        return fitness_scores
+    
+    def committedFitness(self): #fitness of committed canvas, on the level that gives final candidate scores
+        fine = [level for level in self.pyramid_levels if level["simplification"] < self.IMAGE_SIMPLIFICATION]
         
-        if progress_callback is not None:
-            progress_callback(count, g, BEST_SCORE)
+        if fine:
+            return fine[-1]["engine"].committedScore()
         
-        if g < GENERATIONS_PER_LOOP - 1: #mutating best n carbs to replenish the population
-            for card in best_100_cards:
-                generation_cards.extend(mutateCard(card, CARDS_MUTATIONS_COUNT))
+        return self.engine.committedScore()
     
-    return generation_cards[0]
-
-def mainLoop(progress_callback=None, stop_event=None): #main loop
-    card_list = []
+    def commitCard(self, card): #placing card on every canvas of the session
+        self.card_list.append(card)
+        self.placeSmallCard(self.engine, card) #placing card on canvas
+        
+        for level in self.pyramid_levels:
+            level["engine"].commit(*self.levelSprite(card, level))
+        
+        self.placeCard(self.full_canvas, card)
+        
+        if self.preview_canvas is not None:
+            self.placeCard(self.preview_canvas, card, self.preview_scale)
+        
+        if self.snapshot_canvas is not None and self.snapshot_canvas is not self.preview_canvas:
+            self.placeCard(self.snapshot_canvas, card, self.snapshot_scale)
+    
+    def replayCards(self, card_list): #committing saved cards again (rebuilds every canvas of the session)
+        for i in range(len(card_list)):
+            self.commitCard(card_list[i].copy())
     
-    count = 0;
+    def checkpointPath(self):
+        return os.path.join(self.RESULTS_FOLDER, self.CHECKPOINT_FILE)
     
-    while count < MAX_LOOP_COUNT:
-        count += 1
+    def checkpoint(self, path=None): #writing committed state of the session to checkpoint file
+        card_list = np.array(self.card_list, dtype=Genome.GENOME_DTYPE)
+        
+        writeCheckpoint(path if path is not None else self.checkpointPath(), {
+            "target_path": self.TARGET_PATH,
+            "loop": self.loop,
+            "best_score": self.best_score,
+            "history": self.history,
+            "rng": rngState(self.rng),
+            "config": self.config(),
+            "cards": Genome.populationToLists(card_list)
+        })
+    
+    def exportDocument(self, path=None): #writing genome document of committed cards (resolution independent result)
+        Export.writeDocument(path if path is not None else os.path.join(self.RESULTS_FOLDER, self.DOCUMENT_FILE),
+                             (self.CANVAS_WIDTH, self.CANVAS_HEIGHT), (self.CARD_STANDART_WIDTH, self.CARD_STANDART_HEIGHT),
+                             self.CANVAS_BACKGROUND, self.deck.card_files, self.card_list)
+    
+    def openSnapshotSinks(self, on_saved): #sinks of SNAPSHOT_SINKS, encoding ones run on a background thread
+        sinks = []
+        background = []
+        
+        size = self.snapshot_canvas.size if self.snapshot_canvas is not None else self.full_canvas.size
+        
+        try:
+            for name in self.SNAPSHOT_SINKS:
+                if name == "png":
+                    writer = SnapshotWriter(self.SNAPSHOT_QUEUE_SIZE, self.SNAPSHOT_COMPRESS_LEVEL,
+                                            self.SNAPSHOT_KEEP_LAST, self.SNAPSHOT_KEEP_EVERY, on_saved)
+                    sinks.append(PngFileSink(writer, self.RESULTS_FOLDER))
+                elif name == "apng":
+                    background.append(ApngSink(os.path.join(self.RESULTS_FOLDER, self.SNAPSHOT_APNG_FILE),
+                                               self.SNAPSHOT_APNG_FPS, self.SNAPSHOT_COMPRESS_LEVEL))
+                elif name == "pipe":
+                    if not self.SNAPSHOT_PIPE_COMMAND:
+                        raise ValueError("Snapshot sink pipe needs SNAPSHOT_PIPE_COMMAND")
+                    
+                    background.append(PipeSink(self.SNAPSHOT_PIPE_COMMAND, size))
+                else:
+                    raise ValueError("Unknown snapshot sink " + str(name))
+        except Exception: #closing sinks opened before the failing one (writer threads, encoder processes)
+            for sink in sinks + background:
+                try:
+                    sink.close()
+                except Exception:
+                    pass
+            
+            raise
+        
+        if background:
+            sinks.append(SinkThread(background, self.SNAPSHOT_QUEUE_SIZE))
+        
+        return sinks
+    
+    def closeSnapshotSinks(self, sinks): #waiting for queued snapshots, returns errors of every sink as text
+        errors = []
+        
+        for sink in sinks:
+            try:
+                sink.close()
+            except Exception as e:
+                errors.append(type(sink).__name__ + ": " + type(e).__name__ + ": " + str(e))
+            
+            for where, e in getattr(sink, "errors", []):
+                errors.append(str(where) + ": " + type(e).__name__ + ": " + str(e))
+        
+        return errors
+    
+    def pushPreview(self, count): #putting copy of preview canvas into preview slot
+        if self.preview is not None and self.preview_canvas is not None:
+            self.preview.put(self.preview_canvas.copy(), count)
+    
+    def statsSnapshot(self): #statistics of the session with counters of sprite caches
+        disk = self.sprites.disk
+        
+        return self.stats.snapshot(loop=self.loop, fitness=self.committedFitness(), sprite_cache=self.sprites.stats(),
+                                   disk_cache=disk.stats() if disk is not None else None)
+    
+    def reportStats(self, count, progress_callback): #sending statistics to callback and trace file
+        snapshot = self.statsSnapshot()
+        
+        if self.STATS_TRACE_FILE:
+            appendTrace(self.STATS_TRACE_FILE, snapshot)
         
         if progress_callback is not None:
-            progress_callback(count, 0, BEST_SCORE)
+            progress_callback(count, 0, self.best_score, stats=snapshot)
+    
+    def generationLoop(self, count, progress_callback, stop_event): #Loop of n generations, creates 1 best card to place on canvas
+        with self.stats.stage("mutation"):
+            generation_cards = self.createRandomCards(self.CARDS_TOTAL_COUNT) #create initial random set of cards
         
-        new_card = generationLoop(count, progress_callback, stop_event) #getting new card to place
+        plateau_best = -np.inf
+        plateau_count = 0
         
-        if stop_event is not None and stop_event.is_set():
-            return         
+        for g in range(self.GENERATIONS_PER_LOOP):
+            if stop_event is not None and stop_event.is_set():
+                return generation_cards[0].copy()
+            
+            if self.SOLVE_TINT:
+                with self.stats.stage("solve_tint"):
+                    self.solveTints(generation_cards)
+            
+            with self.stats.stage("scoring"):
+                if self.pyramid_levels:
+                    fitness_scores = self.screenPopulation(generation_cards, stop_event)
+                else:
+                    fitness_scores = self.scorePopulation(generation_cards, stop_event)
+            
+            if fitness_scores is None: #stopped while scoring
+                return generation_cards[0].copy()
+            
+            self.stats.count("candidates", len(generation_cards))
+            self.stats.count("generations")
+            
+            with self.stats.stage("selection"):
+                if self.CARD_CENTER_BOX is not None or self.CARD_BOUNDS_BOX is not None: #cards owned by other tiles
+                    fitness_scores[~self.placementMask(generation_cards)] = -np.inf
+                
+                #taking top n cards, sorted best to worst
+                best_cards, best_scores = Genome.selectTop(generation_cards, fitness_scores, self.CARDS_WINNERS_COUNT)
+            
+            generation_cards = best_cards
+            
+            self.best_score = float(best_scores[0])
+            
+            if progress_callback is not None:
+                progress_callback(count, g, self.best_score)
+            
+            if self.best_score > plateau_best + self.GENERATION_EPSILON: #plateau detection
+                plateau_best = self.best_score
+                plateau_count = 0
+            else:
+                plateau_count += 1
+            
+            if self.GENERATION_PATIENCE and plateau_count >= self.GENERATION_PATIENCE and g < self.GENERATIONS_PER_LOOP - 1:
+                self.stats.count("plateau")
+                
+                if progress_callback is not None:
+                    progress_callback(count, g, self.best_score, event="plateau")
+                break
+            
+            if g < self.GENERATIONS_PER_LOOP - 1: #mutating best n cards to replenish the population
+                with self.stats.stage("mutation"):
+                    generation_cards = np.concatenate((best_cards, self.mutateCards(best_cards, self.CARDS_MUTATIONS_COUNT)))
         
-        card_list.append(new_card)
-        placeSmallCard(SMALL_CANVAS, new_card) #placing card on canvas
+        return generation_cards[0].copy()
+    
+    def islandSettings(self, island): #mutation powers of island (integer powers stay integers)
+        scale = self.ISLAND_MUTATION_SCALES[island % len(self.ISLAND_MUTATION_SCALES)]
+        
+        return {
+            "MUTATE_CARD_PROBABILITY": min(1.0, self.MUTATE_CARD_PROBABILITY * scale),
+            "MUTATE_SIZE_POWER": self.MUTATE_SIZE_POWER * scale,
+            "MUTATE_ROTATION_POWER": max(1, int(round(self.MUTATE_ROTATION_POWER * scale))),
+            "MUTATE_POSITION_POWER": max(1, int(round(self.MUTATE_POSITION_POWER * scale))),
+            "MUTATE_COLOR_POWER": int(round(self.MUTATE_COLOR_POWER * scale)),
+            "MUTATE_TINT_POWER": self.MUTATE_TINT_POWER * scale
+        }
+    
+    def evolveIsland(self, winners, generations): #generations of one island population, winners None = random start, returns new winners and their scores (best first)
+        if winners is None:
+            generation_cards = self.createRandomCards(self.CARDS_TOTAL_COUNT)
+        else:
+            generation_cards = np.concatenate((winners, self.mutateCards(winners, self.CARDS_MUTATIONS_COUNT)))
+        
+        for g in range(generations):
+            if self.SOLVE_TINT:
+                self.solveTints(generation_cards)
+            
+            fitness_scores = self.calculateFitnessBatch(generation_cards)
+            
+            if self.CARD_CENTER_BOX is not None or self.CARD_BOUNDS_BOX is not None:
+                fitness_scores[~self.placementMask(generation_cards)] = -np.inf
             
-        if count % 5 == 0: #saving progress every 5 loops
-            temp_saving = Image.new("RGBA", (CANVAS_WIDTH, CANVAS_HEIGHT), CANVAS_BACKGROUND)
-            for card in card_list:
-                placeCard(temp_saving, card)
+            winners, scores = Genome.selectTop(generation_cards, fitness_scores, self.CARDS_WINNERS_COUNT)
+            
+            if g < generations - 1:
+                generation_cards = np.concatenate((winners, self.mutateCards(winners, self.CARDS_MUTATIONS_COUNT)))
+        
+        return winners, scores
+    
+    def islandLoop(self, count, progress_callback, stop_event): #Loop of n generations on ISLANDS populations in scoring processes, returns best card of all islands
+        islands = [None] * self.ISLANDS #winners of every island
+        best_card = None
+        done = 0
         
-            path = "Results\\temp_save" + str(count) + ".png"
+        while done < self.GENERATIONS_PER_LOOP:
+            if stop_event is not None and stop_event.is_set():
+                break
+            
+            generations = min(self.ISLAND_MIGRATE_EVERY, self.GENERATIONS_PER_LOOP - done)
+            
+            with self.stats.stage("islands"):
+                futures = [self.pool.call(islandInWorker, islands[i], generations, self.islandSettings(i), int(self.rng.integers(2 ** 63)))
+                           for i in range(self.ISLANDS)]
+                results = [fut.result() for fut in futures]
+            
+            done += generations
             
-            temp_saving.save(path)
+            self.stats.count("candidates", self.ISLANDS * generations * self.CARDS_TOTAL_COUNT)
+            self.stats.count("generations", generations)
+            
+            islands = [winners for winners, _ in results]
+            best = max(range(self.ISLANDS), key=lambda i: results[i][1][0])
+            
+            best_card = islands[best][0].copy()
+            self.best_score = float(results[best][1][0])
             
             if progress_callback is not None:
-                progress_callback(count, 0, BEST_SCORE, path)
+                progress_callback(count, done - 1, self.best_score)
+            
+            if done < self.GENERATIONS_PER_LOOP and self.ISLAND_MIGRANTS: #ring migration, best cards replace worst winners of next island
+                migrants = [winners[:self.ISLAND_MIGRANTS].copy() for winners in islands]
+                
+                for i in range(self.ISLANDS):
+                    target = islands[(i + 1) % self.ISLANDS]
+                    target[len(target) - len(migrants[i]):] = migrants[i]
+        
+        if best_card is None: #stopped before first migration
+            return self.createRandomCards(1)[0].copy()
+        
+        return best_card
+    
+    def mainLoop(self, progress_callback=None, stop_event=None): #main loop
+        def snapshotSaved(path, loop): #called on writer thread
+            if progress_callback is not None:
+                progress_callback(loop, 0, self.best_score, path)
+        
+        sinks = self.openSnapshotSinks(snapshotSaved)
+        
+        profiler = None
+        
+        try:
+            while self.loop < self.MAX_LOOP_COUNT:
+                self.loop += 1
+                count = self.loop
+                
+                if progress_callback is not None:
+                    progress_callback(count, 0, self.best_score)
+                
+                committed = self.committedFitness()
+                
+                if count == self.PROFILE_LOOP:
+                    profiler = cProfile.Profile()
+                    profiler.enable()
+                
+                for attempt in range(self.COMMIT_RETRIES + 1):
+                    if self.ISLANDS > 1:
+                        new_card = self.islandLoop(count, progress_callback, stop_event) #getting new card to place
+                    else:
+                        new_card = self.generationLoop(count, progress_callback, stop_event) #getting new card to place
+                    
+                    if stop_event is not None and stop_event.is_set():
+                        self.loop = count - 1 #unfinished loop is run again after resume
+                        return
+                    
+                    #card improves canvas (no card at all may be placed when every candidate was outside its boxes)
+                    if self.best_score > -np.inf and (not self.REJECT_NON_IMPROVING or self.best_score > committed):
+                        break
+                    
+                    self.stats.count("rejected")
+                    
+                    if progress_callback is not None:
+                        progress_callback(count, 0, self.best_score, event="rejected")
+                else: #no improving card found, nothing is placed this loop
+                    new_card = None
+                
+                if profiler is not None:
+                    profiler.disable()
+                    os.makedirs(self.RESULTS_FOLDER, exist_ok=True)
+                    profiler.dump_stats(os.path.join(self.RESULTS_FOLDER, "profile_loop" + str(count) + ".prof"))
+                    profiler = None
+                
+                self.stats.count("loops")
+                
+                if new_card is None:
+                    self.history.append(committed)
+                else:
+                    with self.stats.stage("commit"):
+                        self.commitCard(new_card)
+                    
+                    self.history.append(self.committedFitness())
+                    
+                    if sinks and count % self.SNAPSHOT_EVERY == 0: #saving progress every n loops
+                        with self.stats.stage("snapshot"):
+                            frame = (self.snapshot_canvas if self.snapshot_canvas is not None else self.full_canvas).copy()
+                            
+                            for sink in sinks:
+                                sink.write(frame, count)
+                    
+                    if self.PREVIEW_EVERY and count % self.PREVIEW_EVERY == 0:
+                        self.pushPreview(count)
+                
+                if self.CHECKPOINT_EVERY and count % self.CHECKPOINT_EVERY == 0:
+                    with self.stats.stage("checkpoint"):
+                        self.checkpoint()
+                
+                if self.STATS_EVERY and count % self.STATS_EVERY == 0:
+                    self.reportStats(count, progress_callback)
+                
+                #global stop once improvement per loop is too small
+                if self.LOOP_PATIENCE and len(self.history) > self.LOOP_PATIENCE:
+                    if (self.history[-1] - self.history[-1 - self.LOOP_PATIENCE]) / self.LOOP_PATIENCE < self.LOOP_MIN_IMPROVEMENT:
+                        if progress_callback is not None:
+                            progress_callback(count, 0, self.best_score, event="converged")
+                        break
+        finally:
+            if profiler is not None: #stopped inside profiled loop
+                profiler.disable()
+            
+            self.snapshot_errors = self.closeSnapshotSinks(sinks)
+            
+            if self.snapshot_errors and progress_callback is not None:
+                progress_callback(self.loop, 0, self.best_score, event="snapshot_failed", errors=self.snapshot_errors)
+            
+            if self.CHECKPOINT_EVERY: #last state, also when stopped or failed
+                self.checkpoint()
+        
+        self.pushPreview(self.loop) #final state, also when it was not pushed by the last loop
+        
+        #display the result
+        if self.SHOW_RESULT:
+            self.full_canvas.show()
+        
+        os.makedirs(self.RESULTS_FOLDER, exist_ok=True)
+        self.full_canvas.save(os.path.join(self.RESULTS_FOLDER, "result.png"))
+        self.exportDocument()
+        
+        if self.snapshot_errors and progress_callback is None: #nobody was told, result is saved but snapshots are missing
+            raise RuntimeError("Snapshots failed: " + "; ".join(self.snapshot_errors))
     
-    #display the result
-    result_canvas = Image.new("RGBA", (CANVAS_WIDTH, CANVAS_HEIGHT), CANVAS_BACKGROUND)
-    for card in card_list:
-        placeCard(result_canvas, card)
+    def run(self, progress_callback=None, stop_event=None): #running evolution with scoring pool started for this run
+        self.startPool()
+        
+        try:
+            self.mainLoop(progress_callback, stop_event)
+        finally: #stopping scoring pool of this run
+            self.closePool()
+
+def setupScoreWorker(engine, config): #setting up scoring process of the pool
+    global WORKER_SESSION
     
-    result_canvas.show()
-    result_canvas.save("Results\\result.png")
+    WORKER_SESSION = EvolutionSession.scoringWorker(engine, config)
+
+def scoreInWorker(card_list): #scoring cards in scoring process
+    return WORKER_SESSION.calculateFitnessBatch(card_list)
 
-def loadCards(): #loading card deck
-    for id in cards.keys():
-        CARD_IMAGES[id] = Image.open("Deck\\" + cards[id]).convert("RGBA")
+def islandInWorker(winners, generations, settings, seed): #evolving one island in scoring process, settings are its mutation powers
+    for name, value in settings.items():
+        setattr(WORKER_SESSION, name, value)
+    
+    WORKER_SESSION.rng = np.random.default_rng(seed)
     
+    return WORKER_SESSION.evolveIsland(winners, generations)
+
 def runEvolution(
     loops=MAX_LOOP_COUNT,
     generations_per_loop=GENERATIONS_PER_LOOP,
@@ -341,40 +1055,33 @@ def runEvolution(
     weight_ssim=WEIGHT_SSIM,
     target_path=TARGET_PATH,
     progress_callback=None,
-    stop_event=None
-): #setting up custom values from UI
+    stop_event=None,
+    seed=RANDOM_SEED,
+    resume_path=None,
+    preview=None
+): #setting up custom values from UI, runs one session and returns it (resume_path continues checkpoint with its own settings up to loops, preview is a PreviewSlot)
     
-    global MAX_LOOP_COUNT, GENERATIONS_PER_LOOP, IMAGE_SIMPLIFICATION, TARGET_PATH, WEIGHT_COLOR, WEIGHT_SSIM
-    global CANVAS_WIDTH, CANVAS_HEIGHT, SCORE_CANVAS_WIDTH, SCORE_CANVAS_HEIGHT, CARD_SMALL_WIDTH, CARD_SMALL_HEIGHT, SMALL_CANVAS
-    global target_full, target_small, target_small_arr, target_gray_arr, USE_COLOR, USE_SSIM
-   
     if image_simplification < 1:
-        return
-    
-    MAX_LOOP_COUNT = loops
-    GENERATIONS_PER_LOOP = generations_per_loop
-    IMAGE_SIMPLIFICATION = image_simplification
-    USE_COLOR = use_color
-    WEIGHT_COLOR = weight_color
-    USE_SSIM = use_ssim 
-    WEIGHT_SSIM = weight_ssim
-    TARGET_PATH = target_path
-     
-    #creating full and small canvas, calculating small cards and canvas size
-    target_full = Image.open(TARGET_PATH).convert("RGB")
-    
-    CANVAS_WIDTH, CANVAS_HEIGHT = target_full.size
-    SCORE_CANVAS_WIDTH = int(CANVAS_WIDTH / IMAGE_SIMPLIFICATION)
-    SCORE_CANVAS_HEIGHT = int(CANVAS_HEIGHT / IMAGE_SIMPLIFICATION)
-    
-    target_small = target_full.resize((SCORE_CANVAS_WIDTH, SCORE_CANVAS_HEIGHT), Image.LANCZOS)
-    target_small_arr = np.asarray(target_small, dtype=np.float32)
-    target_gray_arr = np.asarray(target_small.convert("L"), dtype=np.float32)
-    
-    CARD_SMALL_WIDTH = int(CARD_STANDART_WIDTH / IMAGE_SIMPLIFICATION)
-    CARD_SMALL_HEIGHT = int(CARD_STANDART_HEIGHT / IMAGE_SIMPLIFICATION)
-    
-    SMALL_CANVAS = Image.new("RGBA", (SCORE_CANVAS_WIDTH, SCORE_CANVAS_HEIGHT), CANVAS_BACKGROUND)
-    
-    loadCards()
-    mainLoop(progress_callback, stop_event)
\ No newline at end of file
+        return None
+    
+    if resume_path is not None:
+        session = EvolutionSession.resume(resume_path, MAX_LOOP_COUNT=loops)
+        session.preview = preview
+        session.run(progress_callback, stop_event)
+        
+        return session
+    
+    session = EvolutionSession(target_path,
+                               MAX_LOOP_COUNT=loops,
+                               GENERATIONS_PER_LOOP=generations_per_loop,
+                               IMAGE_SIMPLIFICATION=image_simplification,
+                               USE_COLOR=use_color,
+                               WEIGHT_COLOR=weight_color,
+                               USE_SSIM=use_ssim,
+                               WEIGHT_SSIM=weight_ssim,
+                               RANDOM_SEED=seed)
+    
+    session.preview = preview
+    session.run(progress_callback, stop_event)
+    
+    return session
@@ -0,0 +1,38 @@
+# Preview for Image Recreation Using Cards
+# The session keeps a small canvas (longest side PREVIEW_SIZE) that gets
+# every committed card like the full size canvas does, and puts copies of
+# it into a PreviewSlot. The slot only holds the newest frame, so the loop
+# never waits for a slow reader and a reader never gets stale frames. The
+# UI polls the slot at a capped frame rate, nothing is read from disk.
+
+import threading
+
+class PreviewSlot:
+    def __init__(self):
+        self._frame = None #(image, info) not taken yet
+        self._lock = threading.Lock()
+
+        self.put_count = 0
+        self.dropped = 0 #frames replaced before anyone took them
+
+    def put(self, image, info=None): #replacing waiting frame, image must not be changed afterwards (pass a copy)
+        with self._lock:
+            if self._frame is not None:
+                self.dropped += 1
+
+            self._frame = (image, info)
+            self.put_count += 1
+
+    def take(self): #newest frame as (image, info), None if there is no new one
+        with self._lock:
+            frame = self._frame
+            self._frame = None
+
+        return frame
+
+    def clear(self):
+        with self._lock:
+            self._frame = None
+
+def previewScale(width, height, size): #scale of preview canvas for canvas of width x height (never above 1)
+    return min(1.0, size / max(width, height))
@@ -0,0 +1,115 @@
+# Residual sampler for Image Recreation Using Cards
+# Creates new cards where the committed canvas is still far from the
+# target: positions are drawn proportionally to the per-pixel squared
+# error, scale is biased toward the size of the error blob around the
+# drawn point and tint is seeded from the target's mean colour under the
+# proposed footprint.
+
+import numpy as np
+
+from Genome import GENOME_DTYPE, clampPositions
+
+#mean residual of a bigger footprint must stay above this part of the smallest one to count as same blob
+BLOB_RATIO = 0.5
+BLOB_SCALES = 8
+
+#spread of sampled scale around the blob scale (log-normal sigma)
+SCALE_SPREAD = 0.25
+
+def integralImage(arr): #summed area table with zero first row/column (float64)
+    integral = np.zeros((arr.shape[0] + 1, arr.shape[1] + 1) + arr.shape[2:], dtype=np.float64)
+    np.cumsum(arr, axis=0, dtype=np.float64, out=integral[1:, 1:])
+    np.cumsum(integral[1:, 1:], axis=1, out=integral[1:, 1:])
+
+    return integral
+
+def boxMeans(integral, cx, cy, half_w, half_h): #mean of boxes centred at cx, cy (clipped to canvas), all arguments are arrays
+    h = integral.shape[0] - 1
+    w = integral.shape[1] - 1
+
+    x0 = np.clip(np.floor(cx - half_w), 0, w - 1).astype(np.intp)
+    y0 = np.clip(np.floor(cy - half_h), 0, h - 1).astype(np.intp)
+    x1 = np.clip(np.ceil(cx + half_w), x0 + 1, w).astype(np.intp)
+    y1 = np.clip(np.ceil(cy + half_h), y0 + 1, h).astype(np.intp)
+
+    sums = integral[y1, x1] - integral[y0, x1] - integral[y1, x0] + integral[y0, x0]
+    area = (x1 - x0) * (y1 - y0)
+
+    if sums.ndim > area.ndim: #colour integral image
+        area = area[..., None]
+
+    return sums / area
+
+def cardMeanColors(card_images, card_count): #mean rgb of every card face under its alpha, index is card_no
+    means = np.zeros((card_count + 1, 3), dtype=np.float32)
+
+    for card_no, img in card_images.items():
+        arr = np.asarray(img, dtype=np.float32)
+        alpha = arr[:, :, 3:] / 255.0
+
+        means[card_no] = (arr[:, :, :3] * alpha).sum(axis=(0, 1)) / max(float(alpha.sum()), 1.0)
+
+    return means
+
+def residualPopulation(rng, count, error_map, target_rgb, simplification, card_means,
+                       canvas_size, card_size, scale_range, tint_power_range, card_index=None, top_k=3): #count of cards placed by residual of committed canvas (faces picked by card_index if given)
+    card_w, card_h = card_size
+    height, width = error_map.shape
+    card_count = len(card_means) - 1
+
+    population = np.empty(count, dtype=GENOME_DTYPE)
+
+    population["card_no"] = rng.integers(1, card_count + 1, count)
+    population["rotation"] = rng.uniform(-360, 0, count)
+    population["tint_power"] = rng.uniform(tint_power_range[0], tint_power_range[1], count)
+
+    #drawing centres proportionally to residual (uniform if canvas already matches)
+    weights = error_map.astype(np.float64).ravel()
+    total = weights.sum()
+
+    if total > 0:
+        flat = rng.choice(weights.size, count, p=weights / total)
+    else:
+        flat = rng.integers(0, weights.size, count)
+
+    cy = flat // width + rng.random(count)
+    cx = flat % width + rng.random(count)
+
+    #blob size: biggest card footprint whose mean residual is still close to the smallest one
+    residual_integral = integralImage(error_map)
+    scales = np.geomspace(scale_range[0], scale_range[1], BLOB_SCALES)
+
+    half_w = card_w * scales / simplification / 2
+    half_h = card_h * scales / simplification / 2
+
+    means = boxMeans(residual_integral, cx[:, None], cy[:, None], half_w[None, :], half_h[None, :])
+    same_blob = means >= BLOB_RATIO * means[:, :1]
+    blob = BLOB_SCALES - 1 - np.argmax(same_blob[:, ::-1], axis=1)
+
+    scale = scales[blob] * np.exp(rng.normal(0, SCALE_SPREAD, count))
+    population["scale"] = np.clip(scale, scale_range[0], scale_range[1])
+
+    #centre to top left corner of rotated card in full size coordinates
+    angle = np.radians(population["rotation"])
+    rotated_w = np.abs(card_w * np.cos(angle)) + np.abs(card_h * np.sin(angle))
+    rotated_h = np.abs(card_w * np.sin(angle)) + np.abs(card_h * np.cos(angle))
+
+    population["x"] = (cx * simplification - rotated_w * population["scale"] / 2).astype(np.int32)
+    population["y"] = (cy * simplification - rotated_h * population["scale"] / 2).astype(np.int32)
+
+    clampPositions(population, canvas_size, card_size)
+
+    if card_index is not None:
+        population["card_no"] = card_index.choose(rng, population, simplification, card_size, top_k)
+
+    #tint which turns card's mean colour into target's mean colour under footprint
+    foot_w = card_w * population["scale"] / simplification / 2
+    foot_h = card_h * population["scale"] / simplification / 2
+
+    target_mean = boxMeans(integralImage(target_rgb), cx, cy, foot_w, foot_h)
+    base_mean = card_means[population["card_no"]]
+    power = population["tint_power"][:, None]
+
+    population["tint"] = np.clip((target_mean - (1 - power) * base_mean) / power, 0, 255).astype(np.uint8)
+
+    return population
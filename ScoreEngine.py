@@ -0,0 +1,405 @@
+# Score engine for Image Recreation Using Cards
+# Keeps the scaled (down) canvas as a persistent float32 NumPy array and
+# scores candidate cards by alpha compositing them into small patch
+# arrays. NumPy releases the GIL for the heavy array work, so scoring
+# threads can actually run in parallel.
+#
+# Color error is kept as a per-pixel map of the committed canvas and SSIM
+# as a per-window map (FastSSIM), so a candidate only pays for the
+# rectangle its (rotated) sprite covers.
+#
+# scoreBatch scores many candidates at once: their dirty windows are
+# stacked into (N, H, W, C) arrays and both terms are computed with a few
+# vectorized calls, which amortizes Python overhead over the population.
+# With a Stats object set, scoreBatch adds time of compositing, color error
+# and SSIM as stages "scoring.composite", "scoring.mse" and "scoring.ssim".
+
+import time
+
+import numpy as np
+
+from FastSSIM import FastSSIM
+
+#same weights as PIL "L" conversion (ITU-R 601-2 luma)
+GRAY_WEIGHTS = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+#normalisation of mse in color score
+COLOR_MSE_SCALE = 5000.0
+
+#limits of one stacked batch in scoreBatch, small stacks stay in cpu cache
+BATCH_SIZE = 64
+BATCH_PIXELS = 8192
+
+def toGray(rgb, out=None): #grayscale plane of float32 rgb array (out can be a view into a bigger plane)
+    return np.einsum("...k,k->...", rgb, GRAY_WEIGHTS, out=out)
+
+def clipRegion(shape, x, y, w, h): #clipping sprite placed at x, y to the canvas, returns (canvas box, sprite box) or None
+    canvas_h, canvas_w = shape[0], shape[1]
+
+    x0 = max(x, 0)
+    y0 = max(y, 0)
+    x1 = min(x + w, canvas_w)
+    y1 = min(y + h, canvas_h)
+
+    if x0 >= x1 or y0 >= y1:
+        return None
+
+    return (x0, y0, x1, y1), (x0 - x, y0 - y, x1 - x, y1 - y)
+
+def blendPatch(patch, rgb, alpha, sprite_box): #alpha blending part of sprite into patch array in place
+    sx0, sy0, sx1, sy1 = sprite_box
+
+    patch += alpha[sy0:sy1, sx0:sx1] * (rgb[sy0:sy1, sx0:sx1] - patch)
+
+def compositeInto(dst, rgb, alpha, x, y): #alpha blending sprite into dst array in place (same as PIL paste with mask)
+    boxes = clipRegion(dst.shape, x, y, rgb.shape[1], rgb.shape[0])
+
+    if boxes is None:
+        return None
+
+    (x0, y0, x1, y1), sprite_box = boxes
+
+    blendPatch(dst[y0:y1, x0:x1], rgb, alpha, sprite_box)
+
+    return x0, y0, x1, y1
+
+class ScoreEngine:
+    def __init__(self, target_rgb, use_color=True, weight_color=0.7, use_ssim=True, weight_ssim=0.3):
+        self.target_rgb = np.ascontiguousarray(target_rgb, dtype=np.float32)
+        self.target_gray = toGray(self.target_rgb)
+
+        self.height, self.width = self.target_gray.shape
+
+        self.use_color = use_color
+        self.weight_color = weight_color
+        self.use_ssim = use_ssim
+        self.weight_ssim = weight_ssim
+
+        #committed canvas (RGB, black background) and its grayscale plane
+        self.canvas = np.zeros((self.height, self.width, 3), dtype=np.float32)
+        self.gray = np.zeros((self.height, self.width), dtype=np.float32)
+
+        #per-pixel squared color error of committed canvas (summed over channels)
+        self.error_map = np.empty((self.height, self.width), dtype=np.float32)
+        self.error_count = self.height * self.width * 3
+        self.error_total = 0.0
+        self._updateError((0, 0, self.width, self.height))
+
+        #target side ssim statistics are precomputed once
+        self.ssim = FastSSIM(self.target_gray, data_range=255) if use_ssim else None
+
+        if self.ssim is not None:
+            self.ssim.reset(self.gray)
+
+        self.stats = None #Stats receiving scoring stages (None = not measured)
+
+    @classmethod
+    def attach(cls, arrays, totals, use_color=True, weight_color=0.7, use_ssim=True, weight_ssim=0.3): #engine over existing state arrays (e.g. shared memory), nothing is recomputed
+        engine = cls.__new__(cls)
+
+        engine.use_color = use_color
+        engine.weight_color = weight_color
+        engine.use_ssim = use_ssim
+        engine.weight_ssim = weight_ssim
+
+        engine.ssim = FastSSIM.attach(arrays) if use_ssim else None
+        engine.stats = None
+        engine.rebind(arrays)
+        engine.setTotals(totals)
+
+        return engine
+
+    def rebind(self, arrays): #switching engine to other state arrays with the same content (e.g. out of shared memory)
+        self.target_rgb = arrays["target_rgb"]
+        self.target_gray = arrays["target_gray"]
+        self.canvas = arrays["canvas"]
+        self.gray = arrays["gray"]
+        self.error_map = arrays["error_map"]
+
+        self.height, self.width = self.target_gray.shape
+        self.error_count = self.height * self.width * 3
+
+        if self.ssim is not None:
+            self.ssim.rebind(arrays)
+
+    def arrays(self): #named arrays holding the whole engine state
+        arrays = {
+            "target_rgb": self.target_rgb,
+            "target_gray": self.target_gray,
+            "canvas": self.canvas,
+            "gray": self.gray,
+            "error_map": self.error_map
+        }
+
+        if self.ssim is not None:
+            arrays.update(self.ssim.arrays())
+
+        return arrays
+
+    def totals(self): #running sums of committed canvas (error, ssim)
+        return self.error_total, self.ssim.s_total if self.ssim is not None else 0.0
+
+    def setTotals(self, totals):
+        self.error_total = totals[0]
+
+        if self.ssim is not None:
+            self.ssim.s_total = totals[1]
+
+    def _updateError(self, box): #recomputing error map inside box and the committed total
+        x0, y0, x1, y1 = box
+
+        diff = self.canvas[y0:y1, x0:x1] - self.target_rgb[y0:y1, x0:x1]
+        np.square(diff, out=diff)
+        diff.sum(axis=2, out=self.error_map[y0:y1, x0:x1])
+
+        self.error_total = float(self.error_map.sum(dtype=np.float64)) #full resum, so rounding errors do not pile up
+
+    def candidatePatch(self, rgb, alpha, x, y): #canvas box touched by sprite and the composited patch (None if off canvas)
+        boxes = clipRegion(self.canvas.shape, x, y, rgb.shape[1], rgb.shape[0])
+
+        if boxes is None:
+            return None, None
+
+        (x0, y0, x1, y1), sprite_box = boxes
+
+        patch = self.canvas[y0:y1, x0:x1].copy()
+        blendPatch(patch, rgb, alpha, sprite_box)
+
+        return (x0, y0, x1, y1), patch
+
+    def colorScore(self, box, patch): #color score from committed error total + delta inside box
+        sq_total = self.error_total
+
+        if box is not None:
+            x0, y0, x1, y1 = box
+
+            diff = patch - self.target_rgb[y0:y1, x0:x1]
+            np.square(diff, out=diff)
+
+            sq_total += float(diff.sum(dtype=np.float64)) - float(self.error_map[y0:y1, x0:x1].sum(dtype=np.float64))
+
+        mse = max(sq_total, 0.0) / self.error_count
+
+        return 1.0 / (1.0 + mse / COLOR_MSE_SCALE)
+
+    def ssimScore(self, box, patch): #ssim of canvas with patch placed in box
+        if box is None:
+            return self.ssim.mean()
+
+        return self.ssim.score(self.gray, box, toGray(patch))
+
+    def solveTint(self, rgb, alpha, x, y, power_range): #least-squares (tint, tint_power) of untinted sprite at x, y (None if sprite is not visible)
+        boxes = clipRegion(self.canvas.shape, x, y, rgb.shape[1], rgb.shape[0])
+
+        if boxes is None:
+            return None
+
+        (x0, y0, x1, y1), (sx0, sy0, sx1, sy1) = boxes
+
+        a = alpha[sy0:sy1, sx0:sx1].astype(np.float64)
+        base = rgb[sy0:sy1, sx0:sx1]
+        canvas = self.canvas[y0:y1, x0:x1]
+
+        #composite is canvas * (1 - a) + a * base + a * (p * tint - p * base), what is left to explain is linear in p and p * tint
+        residual = self.target_rgb[y0:y1, x0:x1] - canvas * (1 - a) - a * base
+
+        a2 = a * a
+        s_aa = float(a2.sum())
+
+        if s_aa < 1e-6:
+            return None
+
+        s_aab = (a2 * base).sum(axis=(0, 1))
+        s_aabb = float((a2 * base * base).sum())
+        s_ar = (a * residual).sum(axis=(0, 1))
+        s_abr = float((a * base * residual).sum())
+
+        #normal equations for (p, p * tint_r, p * tint_g, p * tint_b)
+        normal = np.empty((4, 4))
+        normal[0, 0] = s_aabb
+        normal[0, 1:] = -s_aab
+        normal[1:, 0] = -s_aab
+        normal[1:, 1:] = np.eye(3) * s_aa
+
+        rhs = np.concatenate(([-s_abr], s_ar))
+
+        solution = np.linalg.lstsq(normal, rhs, rcond=None)[0]
+
+        #clamping power, then best tint for that power
+        power = float(np.clip(solution[0], power_range[0], power_range[1]))
+        tint = np.clip((s_ar + power * s_aab) / (power * s_aa), 0, 255)
+
+        return tint, power
+
+    def committedScore(self): #fitness of committed canvas without any candidate
+        color_score = self.colorScore(None, None) if self.use_color else 0
+        ssim_val = self.ssim.mean() if self.ssim is not None else 0
+
+        return self.combine(color_score, ssim_val)
+
+    def combine(self, color_score, ssim_val): #weighted fitness
+        return color_score * self.weight_color + ssim_val * self.weight_ssim
+
+    def score(self, rgb, alpha, x, y): #fitness of canvas with sprite placed at x, y
+        box, patch = self.candidatePatch(rgb, alpha, x, y)
+
+        ssim_val = self.ssimScore(box, patch) if self.use_ssim else 0
+        color_score = self.colorScore(box, patch) if self.use_color else 0
+
+        return self.combine(color_score, ssim_val)
+
+    def scoreBatch(self, sprites, batch_size=BATCH_SIZE, batch_pixels=BATCH_PIXELS): #fitness of every (rgb, alpha, x, y) sprite, as float64 array
+        use_ssim = self.use_ssim and self.ssim is not None
+        pad = self.ssim.win_size - 1 if use_ssim else 0
+
+        #boxes of every candidate, region is the box padded by ssim window
+        items = []
+
+        for i, (rgb, alpha, x, y) in enumerate(sprites):
+            boxes = clipRegion(self.canvas.shape, x, y, rgb.shape[1], rgb.shape[0])
+
+            if boxes is None:
+                continue
+
+            box, sprite_box = boxes
+
+            if use_ssim:
+                wx0, wy0, wx1, wy1 = self.ssim.windowBox(box)
+                region = (wx0, wy0, wx1 + pad, wy1 + pad)
+            else:
+                region = box
+
+            items.append((i, box, sprite_box, region))
+
+        #candidates off canvas keep the committed score
+        color_scores = np.full(len(sprites), self.colorScore(None, None) if self.use_color else 0.0)
+        ssim_vals = np.full(len(sprites), self.ssim.mean() if use_ssim else 0.0)
+
+        #similar sized regions share a batch, so little of the stack is padding
+        items.sort(key=lambda item: (item[3][3] - item[3][1], item[3][2] - item[3][0]))
+
+        start = 0
+
+        while start < len(items):
+            end = start + 1
+            hm = items[start][3][3] - items[start][3][1]
+            wm = items[start][3][2] - items[start][3][0]
+
+            while end < len(items) and end - start < batch_size: #growing batch while padded stack fits the pixel budget
+                hm = max(hm, items[end][3][3] - items[end][3][1])
+                wm = max(wm, items[end][3][2] - items[end][3][0])
+
+                if (end - start + 1) * hm * wm > batch_pixels:
+                    break
+
+                end += 1
+
+            chunk = items[start:end]
+
+            if len(chunk) == 1: #big region alone, stacking would only add copies
+                i = chunk[0][0]
+
+                t0 = time.perf_counter()
+                box, patch = self.candidatePatch(*sprites[i])
+                t1 = time.perf_counter()
+                color_scores[i] = self.colorScore(box, patch) if self.use_color else 0.0
+                t2 = time.perf_counter()
+                ssim_vals[i] = self.ssimScore(box, patch) if use_ssim else 0.0
+
+                self._addStages(t0, t1, t2, time.perf_counter())
+            else:
+                indices = [i for i, _, _, _ in chunk]
+                color_scores[indices], ssim_vals[indices] = self._scoreStack(sprites, chunk, use_ssim, pad)
+
+            start = end
+
+        return self.combine(color_scores, ssim_vals)
+
+    def _scoreStack(self, sprites, items, use_ssim, pad): #color scores and ssim of one batch, using stacked dirty windows
+        t0 = time.perf_counter()
+
+        n = len(items)
+        hm = max(region[3] - region[1] for _, _, _, region in items)
+        wm = max(region[2] - region[0] for _, _, _, region in items)
+
+        cand = np.zeros((n, hm, wm, 3), dtype=np.float32)
+        mask = np.zeros((n, hm, wm), dtype=bool)
+
+        for k, (i, box, sprite_box, (rx0, ry0, rx1, ry1)) in enumerate(items): #filling stack with committed canvas + candidate
+            rgb, alpha, _, _ = sprites[i]
+            x0, y0, x1, y1 = box
+
+            cand[k, :ry1 - ry0, :rx1 - rx0] = self.canvas[ry0:ry1, rx0:rx1]
+            blendPatch(cand[k, y0 - ry0:y1 - ry0, x0 - rx0:x1 - rx0], rgb, alpha, sprite_box)
+            mask[k, y0 - ry0:y1 - ry0, x0 - rx0:x1 - rx0] = True
+
+        color_scores = np.zeros(n)
+        ssim_vals = np.zeros(n)
+
+        t1 = time.perf_counter()
+
+        if self.use_color: #delta of squared error inside every box
+            target = np.zeros_like(cand)
+            old_error = np.zeros((n, hm, wm), dtype=np.float32)
+
+            for k, (_, _, _, (rx0, ry0, rx1, ry1)) in enumerate(items):
+                target[k, :ry1 - ry0, :rx1 - rx0] = self.target_rgb[ry0:ry1, rx0:rx1]
+                old_error[k, :ry1 - ry0, :rx1 - rx0] = self.error_map[ry0:ry1, rx0:rx1]
+
+            diff = cand - target
+            np.subtract(np.einsum("nhwc,nhwc->nhw", diff, diff), old_error, out=old_error)
+
+            delta = np.where(mask, old_error, 0).sum(axis=(1, 2), dtype=np.float64)
+            mse = np.maximum(self.error_total + delta, 0.0) / self.error_count
+
+            color_scores = 1.0 / (1.0 + mse / COLOR_MSE_SCALE)
+
+        t2 = time.perf_counter()
+
+        if use_ssim: #ssim of every window touched, padded windows are masked out
+            fast = self.ssim
+
+            target_gray = np.zeros((n, hm, wm), dtype=np.float64)
+            uy = np.zeros((n, hm - pad, wm - pad), dtype=np.float64)
+            vy = np.zeros_like(uy)
+            window_mask = np.zeros(uy.shape, dtype=bool)
+            old_sums = np.empty(n, dtype=np.float64)
+
+            for k, (_, _, _, (rx0, ry0, rx1, ry1)) in enumerate(items):
+                wy1 = ry1 - pad
+                wx1 = rx1 - pad
+
+                target_gray[k, :ry1 - ry0, :rx1 - rx0] = fast.target[ry0:ry1, rx0:rx1]
+                uy[k, :wy1 - ry0, :wx1 - rx0] = fast.uy[ry0:wy1, rx0:wx1]
+                vy[k, :wy1 - ry0, :wx1 - rx0] = fast.vy[ry0:wy1, rx0:wx1]
+                window_mask[k, :wy1 - ry0, :wx1 - rx0] = True
+                old_sums[k] = fast.s_map[ry0:wy1, rx0:wx1].sum()
+
+            s_map = fast.ssimMap(toGray(cand), target_gray, uy, vy)
+            new_sums = np.einsum("nhw,nhw->n", s_map, window_mask.astype(np.float64))
+
+            ssim_vals = (fast.s_total - old_sums + new_sums) / fast.window_count
+
+        self._addStages(t0, t1, t2, time.perf_counter())
+
+        return color_scores, ssim_vals
+
+    def _addStages(self, t0, t1, t2, t3): #compositing t0-t1, color error t1-t2, ssim t2-t3
+        if self.stats is not None:
+            self.stats.add("scoring.composite", t1 - t0)
+            self.stats.add("scoring.mse", t2 - t1)
+            self.stats.add("scoring.ssim", t3 - t2)
+
+    def commit(self, rgb, alpha, x, y): #placing sprite on the committed canvas
+        box = compositeInto(self.canvas, rgb, alpha, x, y)
+
+        if box is not None:
+            x0, y0, x1, y1 = box
+
+            toGray(self.canvas[y0:y1, x0:x1], out=self.gray[y0:y1, x0:x1])
+            self._updateError(box)
+
+            if self.ssim is not None:
+                self.ssim.commit(self.gray, box)
+
+        return box
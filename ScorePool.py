@@ -0,0 +1,92 @@
+# Process pool scoring backend for Image Recreation Using Cards
+# Moves the score engine state (target arrays, committed canvas, error and
+# ssim maps) into multiprocessing.shared_memory and starts worker
+# processes once per run. Workers attach to the same memory, so every
+# generation only sends compact card genomes and gets back scores.
+# call() runs any function in a worker against the current committed
+# canvas (island mode evolves whole populations in workers that way).
+
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+from ScoreEngine import ScoreEngine
+
+#engine of worker process and its shared memory blocks (set by _initWorker)
+_WORKER_ENGINE = None
+_WORKER_BLOCKS = []
+
+def _attachArrays(descriptors): #attaching to shared memory blocks created by parent process
+    blocks = []
+    arrays = {}
+
+    for name, (shm_name, shape, dtype) in descriptors.items():
+        shm = SharedMemory(name=shm_name) #workers share resource tracker of parent, which unlinks the blocks
+
+        blocks.append(shm)
+        arrays[name] = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+    return blocks, arrays
+
+def _initWorker(descriptors, engine_config, setup, setup_args): #worker process start, runs once
+    global _WORKER_ENGINE, _WORKER_BLOCKS
+
+    _WORKER_BLOCKS, arrays = _attachArrays(descriptors)
+    _WORKER_ENGINE = ScoreEngine.attach(arrays, (0.0, 0.0), **engine_config)
+
+    if setup is not None:
+        setup(_WORKER_ENGINE, *setup_args)
+
+def _scoreTask(score_fn, cards, totals): #scoring chunk of cards against current committed canvas
+    _WORKER_ENGINE.setTotals(totals)
+
+    return [float(fit) for fit in score_fn(cards)]
+
+def _callTask(fn, args, totals): #running fn against current committed canvas
+    _WORKER_ENGINE.setTotals(totals)
+
+    return fn(*args)
+
+class ScorePool:
+    def __init__(self, engine, workers, engine_config, score_fn, setup=None, setup_args=()):
+        self.score_fn = score_fn
+
+        #copying engine state to shared memory
+        self._blocks = []
+        descriptors = {}
+        arrays = {}
+
+        for name, arr in engine.arrays().items():
+            shm = SharedMemory(create=True, size=max(1, arr.nbytes))
+            view = np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)
+            view[...] = arr
+
+            self._blocks.append(shm)
+            descriptors[name] = (shm.name, arr.shape, arr.dtype.str)
+            arrays[name] = view
+
+        #parent engine works on shared memory too, so commits are seen by workers
+        self.engine = ScoreEngine.attach(arrays, engine.totals(), **engine_config)
+
+        self.executor = ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn"),
+                                            initializer=_initWorker,
+                                            initargs=(descriptors, engine_config, setup, setup_args))
+
+    def submit(self, cards): #scoring cards in a worker, returns future of list of scores
+        return self.executor.submit(_scoreTask, self.score_fn, cards, self.engine.totals())
+
+    def call(self, fn, *args): #running fn(*args) in a worker (fn must be picklable, e.g. module function), returns future of its result
+        return self.executor.submit(_callTask, fn, args, self.engine.totals())
+
+    def close(self): #stopping workers and releasing shared memory, engine keeps working on private copies
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+        self.engine.rebind({name: arr.copy() for name, arr in self.engine.arrays().items()})
+
+        for shm in self._blocks:
+            shm.close()
+            shm.unlink()
+
+        self._blocks = []
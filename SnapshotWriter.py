@@ -0,0 +1,81 @@
+# Snapshot writer for Image Recreation Using Cards
+# Saves progress images on a background thread, so the evolution loop
+# does not stall on PNG encoding and disk I/O. The queue is bounded (the
+# loop waits only when the writer is behind by queue_size snapshots) and
+# old snapshots can be removed by a retention policy. Failed saves do not
+# stop the writer, they are kept in errors as (path, exception) for the
+# caller to report.
+
+import os
+import queue
+import threading
+
+class SnapshotWriter:
+    def __init__(self, queue_size=4, compress_level=1, keep_last=None, keep_every=None, on_saved=None):
+        self.compress_level = compress_level
+        self.keep_last = keep_last #number of newest snapshots kept (None = keep all)
+        self.keep_every = keep_every #every n-th snapshot is never removed (None = no exceptions)
+        self.on_saved = on_saved #called on writer thread as on_saved(path, info)
+
+        self.written = 0
+        self.removed = 0
+        self.errors = []
+
+        self._saved = [] #(index, path) of snapshots that can still be removed
+        self._queue = queue.Queue(maxsize=queue_size)
+
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, image, path, info=None, keep=False): #queueing image to save, image must not be changed afterwards (pass a copy)
+        self._queue.put((image, path, info, keep))
+
+    def close(self): #waiting for queued snapshots to be written
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+
+            if job is None:
+                return
+
+            image, path, info, keep = job
+
+            try:
+                folder = os.path.dirname(path)
+
+                if folder:
+                    os.makedirs(folder, exist_ok=True)
+
+                image.save(path, compress_level=self.compress_level)
+            except Exception as e: #reported by caller after close
+                self.errors.append((path, e))
+                continue
+
+            self.written += 1
+
+            if not keep:
+                self._retain(path)
+
+            if self.on_saved is not None:
+                self.on_saved(path, info)
+
+    def _retain(self, path): #removing snapshots that fell out of retention policy
+        self._saved.append((self.written, path))
+
+        if self.keep_last is None:
+            return
+
+        while len(self._saved) > self.keep_last:
+            index, old_path = self._saved.pop(0)
+
+            if self.keep_every and index % self.keep_every == 0:
+                continue
+
+            try:
+                os.remove(old_path)
+                self.removed += 1
+            except OSError:
+                pass
@@ -0,0 +1,128 @@
+# Sprite cache for Image Recreation Using Cards
+# Keeps resized + rotated (untinted) card sprites as NumPy arrays so the
+# scoring path does not re-derive them from the full-size deck for every
+# candidate. Tint is applied at lookup time as a linear blend. With a deck
+# atlas, sprites are resampled from the nearest mip level of the card.
+# Misses go to an optional SpriteDiskCache before rendering.
+
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from PIL import Image
+
+#default cache settings
+ROTATION_STEP = 2 #degrees between two cached rotations
+MAX_BYTES = 256 * 1024 * 1024
+
+class SpriteCache:
+    def __init__(self, card_images, max_bytes=MAX_BYTES, rotation_step=ROTATION_STEP):
+        self.card_images = card_images
+        self.max_bytes = max_bytes
+        self.rotation_step = rotation_step
+        self.atlas = None #DeckAtlas to resample from (None = full size card_images)
+        self.disk = None #SpriteDiskCache of rendered sprites (None = render every miss)
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def quantizeRotation(self, rotation): #snapping rotation to the cache grid
+        step = self.rotation_step
+
+        return (int(round(rotation / step)) * step) % 360
+
+    def getBase(self, card_no, width, height, rotation): #untinted sprite as (rgb, alpha) float32 arrays
+        width = max(1, int(width))
+        height = max(1, int(height))
+        key = (card_no, width, height, self.quantizeRotation(rotation))
+
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+
+            self.misses += 1
+
+        entry = self._render(key) #rendering outside of the lock, so other threads are not blocked
+        size = entry[0].nbytes + entry[1].nbytes
+
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = entry
+                self.bytes += size
+
+            while self.bytes > self.max_bytes and len(self._entries) > 1: #evicting least recently used sprites
+                _, (old_rgb, old_alpha) = self._entries.popitem(last=False)
+                self.bytes -= old_rgb.nbytes + old_alpha.nbytes
+                self.evictions += 1
+
+        return entry
+
+    def getTinted(self, card_no, width, height, rotation, tint, tint_power): #tinted sprite as (rgb, alpha) float32 arrays
+        rgb, alpha = self.getBase(card_no, width, height, rotation)
+
+        tint = np.asarray(tint, dtype=np.float32)
+
+        return rgb + np.float32(tint_power) * (tint - rgb), alpha
+
+    def warmDisk(self, keys): #rendering keys missing in disk cache (keys as (card_no, width, height, quantized rotation)), returns count rendered
+        rendered = 0
+
+        for key in keys:
+            if not self.disk.contains(key):
+                self._render(key)
+                rendered += 1
+
+        return rendered
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self): #counters of the cache
+        with self._lock:
+            lookups = self.hits + self.misses
+
+            return {
+                "entries": len(self._entries),
+                "bytes": self.bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0
+            }
+
+    def _render(self, key): #resizing and rotating sprite from the deck (or loading it from disk cache)
+        card_no, width, height, rotation = key
+
+        if self.disk is not None:
+            entry = self.disk.load(key)
+
+            if entry is not None:
+                return entry
+
+        if self.atlas is not None:
+            source = self.atlas.mip(card_no, width, height)
+        else:
+            source = self.card_images[card_no]
+
+        img = source.resize((width, height), Image.LANCZOS)
+        img = img.rotate(rotation, expand=True)
+
+        arr = np.asarray(img, dtype=np.float32)
+        rgb = np.ascontiguousarray(arr[:, :, :3])
+        alpha = arr[:, :, 3:] / 255.0
+
+        if self.disk is not None:
+            self.disk.store(key, rgb, alpha)
+
+        return rgb, alpha
@@ -0,0 +1,234 @@
+# Disk sprite cache for Image Recreation Using Cards
+# Second level under SpriteCache: untinted resized + rotated sprites are
+# kept as uint8 RGBA .npy files (lossless for the float32 planes the
+# scorer uses) and loaded into the memory cache as float32 planes, so
+# later runs, other targets and other machines sharing the folder reuse
+# them instead of rendering again. Files live under
+# <folder>/<deck hash>/s<simplification>/, the folder has a size cap and
+# the least recently used files are pruned first. Size of the folder is
+# only scanned once a session writes to it, warm caches are not walked.
+#
+# Usage:
+#   python SpriteDiskCache.py info [--folder F]
+#   python SpriteDiskCache.py clear [--folder F] [--deck HASH]
+#   python SpriteDiskCache.py warm --simplification N [--scales N] [--folder F]
+
+import argparse
+import hashlib
+import os
+import shutil
+import threading
+
+import numpy as np
+
+FOLDER = "SpriteCache"
+MAX_BYTES = 1024 * 1024 * 1024
+
+#after going over the cap, oldest files are removed until folder is at this part of it
+PRUNE_RATIO = 0.9
+
+def deckHash(card_images, source): #content hash of the deck (card numbers, pixels and where they were loaded from)
+    digest = hashlib.sha256(source.encode())
+
+    for card_no in sorted(card_images):
+        img = card_images[card_no]
+
+        digest.update(str((card_no, img.size)).encode())
+        digest.update(img.tobytes())
+
+    return digest.hexdigest()[:16]
+
+def scanFiles(folder): #(mtime, size, path) of every cached sprite under folder
+    files = []
+
+    for root, _, names in os.walk(folder):
+        for name in names:
+            if not name.endswith(".npy"):
+                continue
+
+            path = os.path.join(root, name)
+
+            try:
+                stat = os.stat(path)
+            except OSError: #removed by another process meanwhile
+                continue
+
+            files.append((stat.st_mtime_ns, stat.st_size, path))
+
+    return files
+
+class SpriteDiskCache:
+    def __init__(self, folder, deck_hash, simplification, max_bytes=MAX_BYTES):
+        self.folder = folder
+        self.deck_hash = deck_hash
+        self.max_bytes = max_bytes
+        self.path = os.path.join(folder, deck_hash, "s" + str(simplification))
+
+        os.makedirs(self.path, exist_ok=True)
+
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.pruned = 0
+
+        self._lock = threading.Lock()
+        self._bytes = None #size of folder (estimate, other processes write too), scanned on first write
+
+    def _file(self, key):
+        card_no, width, height, rotation = key
+
+        return os.path.join(self.path, str(card_no) + "_" + str(width) + "x" + str(height) + "_r" + str(rotation) + ".npy")
+
+    def contains(self, key):
+        return os.path.exists(self._file(key))
+
+    def load(self, key): #sprite as (rgb, alpha) float32 arrays, None if it is not cached
+        path = self._file(key)
+
+        try:
+            rgba = np.load(path).astype(np.float32)
+        except (OSError, ValueError): #missing, or half written by a crashed process
+            self.misses += 1
+            return None
+
+        try:
+            os.utime(path) #marking as recently used
+        except OSError:
+            pass
+
+        self.hits += 1
+
+        return np.ascontiguousarray(rgba[:, :, :3]), rgba[:, :, 3:] / 255.0
+
+    def store(self, key, rgb, alpha): #writing sprite, file appears only once it is complete
+        rgba = np.concatenate((rgb, np.rint(alpha * 255.0)), axis=2).astype(np.uint8)
+
+        path = self._file(key)
+        temp = path + "." + str(os.getpid()) + "." + str(threading.get_ident()) + ".tmp"
+
+        try:
+            with open(temp, "wb") as f:
+                np.save(f, rgba)
+
+            os.replace(temp, path)
+        except OSError:
+            return
+
+        size = os.path.getsize(path)
+
+        if self._bytes is None: #first write, scanned folder already has this file
+            total = sum(file_size for _, file_size, _ in scanFiles(self.folder))
+
+            with self._lock:
+                if self._bytes is None:
+                    self._bytes = total - size
+
+        with self._lock:
+            self.writes += 1
+            self._bytes += size
+            over = self._bytes > self.max_bytes
+
+        if over:
+            self.prune()
+
+    def prune(self, max_bytes=None): #removing least recently used files until folder is under PRUNE_RATIO of the cap
+        limit = (self.max_bytes if max_bytes is None else max_bytes) * PRUNE_RATIO
+
+        files = sorted(scanFiles(self.folder))
+        total = sum(size for _, size, _ in files)
+
+        for _, size, path in files:
+            if total <= limit:
+                break
+
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+
+            total -= size
+            self.pruned += 1
+
+        with self._lock:
+            self._bytes = total
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "writes": self.writes, "pruned": self.pruned, "bytes": self._bytes}
+
+def info(folder): #printing size of the cache per deck and simplification
+    if not os.path.isdir(folder):
+        print("No sprite cache in " + folder)
+        return
+
+    total_files = 0
+    total_bytes = 0
+
+    for deck in sorted(os.listdir(folder)):
+        deck_path = os.path.join(folder, deck)
+
+        if not os.path.isdir(deck_path):
+            continue
+
+        for level in sorted(os.listdir(deck_path)):
+            files = scanFiles(os.path.join(deck_path, level))
+            size = sum(s for _, s, _ in files)
+
+            print(deck + "  " + level.ljust(5) + str(len(files)).rjust(9) + " sprites" + f"{size / 1024 / 1024:10.1f} MB")
+
+            total_files += len(files)
+            total_bytes += size
+
+    print("total".ljust(24) + str(total_files).rjust(9) + " sprites" + f"{total_bytes / 1024 / 1024:10.1f} MB")
+
+def clear(folder, deck=None): #removing whole cache or one deck of it
+    path = folder if deck is None else os.path.join(folder, deck)
+
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+
+def warm(folder, simplification, scale_count, max_bytes): #rendering sprites of the current deck on a grid of scales and all cached rotations
+    import Main
+
+    deck = Main.Deck(Main.sessionConfig(SPRITE_DISK_CACHE_FOLDER=folder, SPRITE_DISK_CACHE_MAX_MB=max_bytes / 1024 / 1024))
+
+    cache = deck.sprites(simplification)
+    scales = np.geomspace(Main.MIN_CARD_SIZE, Main.MAX_CARD_SIZE, scale_count)
+    rotations = range(0, 360, cache.rotation_step)
+
+    card_width = int(Main.CARD_STANDART_WIDTH / simplification)
+    card_height = int(Main.CARD_STANDART_HEIGHT / simplification)
+
+    keys = set()
+
+    for card_no in deck.images:
+        for scale in scales:
+            width = max(1, int(card_width * scale))
+            height = max(1, int(card_height * scale))
+
+            for rotation in rotations:
+                keys.add((card_no, width, height, rotation))
+
+    rendered = cache.warmDisk(sorted(keys))
+
+    print("Rendered " + str(rendered) + " of " + str(len(keys)) + " sprites into " + cache.disk.path)
+
+def main():
+    parser = argparse.ArgumentParser(description="Disk sprite cache for Image Recreation Using Cards")
+    parser.add_argument("command", choices=["info", "clear", "warm"])
+    parser.add_argument("--folder", default=FOLDER)
+    parser.add_argument("--deck", default=None, help="deck hash to clear (default = whole cache)")
+    parser.add_argument("--simplification", type=int, default=6)
+    parser.add_argument("--scales", type=int, default=8, help="number of card scales to warm")
+    parser.add_argument("--max-mb", type=float, default=MAX_BYTES / 1024 / 1024)
+
+    args = parser.parse_args()
+
+    if args.command == "info":
+        info(args.folder)
+    elif args.command == "clear":
+        clear(args.folder, args.deck)
+    elif args.command == "warm":
+        warm(args.folder, args.simplification, args.scales, args.max_mb * 1024 * 1024)
+
+if __name__ == "__main__":
+    main()
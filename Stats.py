@@ -0,0 +1,95 @@
+# Run statistics for Image Recreation Using Cards
+# Cumulative time and number of calls per stage of the evolution loop and
+# plain counters (candidates, generations, rejected cards...), cheap enough
+# to stay on in the hot path. A snapshot is a plain dict, so it can go
+# through progress_callback, into a JSONL trace file or into JSON results.
+#
+# Stage names with a dot are parts of the stage before the dot (e.g.
+# "scoring.ssim" is inside "scoring"), so shares of top level stages add
+# up to at most the whole run. Stages timed on scoring threads add up
+# time of every thread, so their share can go over 100%.
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+class Stats:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.times = {}
+        self.calls = {}
+        self.counters = {}
+
+        self._lock = threading.Lock() #scoring threads add their stages too
+
+    def add(self, name, seconds, calls=1): #adding measured time to stage
+        with self._lock:
+            self.times[name] = self.times.get(name, 0.0) + seconds
+            self.calls[name] = self.calls.get(name, 0) + calls
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    @contextmanager
+    def stage(self, name): #timing block of code as stage
+        start = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def snapshot(self, **extra): #current statistics as dict, extra items are added as they are
+        elapsed = time.perf_counter() - self.start
+
+        with self._lock:
+            stages = {name: {"time": t, "calls": self.calls[name], "share": t / elapsed if elapsed else 0.0}
+                      for name, t in self.times.items()}
+            counters = dict(self.counters)
+
+        snapshot = {
+            "elapsed": elapsed,
+            "stages": stages,
+            "counters": counters,
+            "candidates_per_s": counters.get("candidates", 0) / elapsed if elapsed else 0.0
+        }
+
+        snapshot.update(extra)
+
+        return snapshot
+
+def formatStages(snapshot, top=None): #stage breakdown as text lines, longest stages first (parts stay under their stage)
+    stages = snapshot["stages"]
+    order = sorted((name for name in stages if "." not in name), key=lambda name: -stages[name]["time"])
+
+    if top is not None:
+        order = order[:top]
+
+    lines = []
+
+    for name in order:
+        for full in [name] + sorted((part for part in stages if part.startswith(name + ".")), key=lambda part: -stages[part]["time"]):
+            stage = stages[full]
+            label = "  " + full.split(".", 1)[1] if full != name else name
+
+            lines.append(label.ljust(14) + f"{stage['time']:8.1f} s" + f"{stage['share'] * 100:6.1f}%")
+
+    lines.append("candidates/s".ljust(14) + f"{snapshot['candidates_per_s']:8.0f}")
+
+    for name in ("sprite_cache", "disk_cache"):
+        cache = snapshot.get(name)
+
+        if cache:
+            lookups = cache["hits"] + cache["misses"]
+            lines.append(name.replace("_", " ").ljust(14) + f"{(cache['hits'] / lookups if lookups else 0.0) * 100:7.1f}% hits")
+
+    return "\n".join(lines)
+
+def appendTrace(path, record): #appending one JSON line to trace file
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    with open(path, "a") as f:
+        f.write(json.dumps(record, separators=(",", ":")) + "\n")
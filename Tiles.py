@@ -0,0 +1,184 @@
+# Tiled runs for Image Recreation Using Cards
+# Very large targets are split into a grid of tiles. Every tile is evolved
+# by its own EvolutionSession in a worker process, against only its part
+# of the target: the tile core plus an overlap on every side, so cards
+# crossing the border are scored against real neighbouring content.
+# Borders are reconciled by ownership: a candidate only gets fitness when
+# its centre is inside the tile core (CARD_CENTER_BOX), so every card
+# belongs to exactly one tile, and when its rotated bounding box is inside
+# the tile region (CARD_BOUNDS_BOX), so no card paints pixels it was not
+# scored against. Cards wider than the overlap can therefore only sit
+# away from the core borders, TILE_OVERLAP should be at least about half
+# of the largest card (CARD_STANDART_HEIGHT * MAX_CARD_SIZE) to cover the
+# borders with big cards. Cards of all tiles are merged in commit order
+# (first cards of every tile first) into one genome document, which
+# Export.py renders in tiles. Evolution and rendering are bounded by tile
+# size; cutting the tiles decodes the whole target once in the parent
+# process (PIL cannot crop PNG/JPEG without decoding them), so that step
+# still needs memory for the full target.
+#
+# Usage:
+#   python Tiles.py target.png [--tile 2048] [--overlap 256] [--jobs N] [--output Tiled]
+#                   [--loops N] [--generations N] [--simplification N] [--seed N]
+#                   [--set NAME=VALUE ...] [--no-render]
+
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import get_context
+
+import numpy as np
+from PIL import Image
+
+import Export
+import Genome
+
+#tile core and overlap on every side, in target pixels
+TILE_SIZE = 2048
+TILE_OVERLAP = 256
+
+Image.MAX_IMAGE_PIXELS = None #targets are meant to be huge
+
+def tileGrid(width, height, tile_size, overlap): #(core box, region box) of every tile, boxes as (x0, y0, x1, y1)
+    tiles = []
+
+    for y0 in range(0, height, tile_size):
+        for x0 in range(0, width, tile_size):
+            core = (x0, y0, min(width, x0 + tile_size), min(height, y0 + tile_size))
+            region = (max(0, core[0] - overlap), max(0, core[1] - overlap),
+                      min(width, core[2] + overlap), min(height, core[3] + overlap))
+
+            tiles.append((core, region))
+
+    return tiles
+
+def runTile(index, tile_path, core, region, canvas_size, settings, folder): #evolving one tile in a worker process, cards are returned in canvas coordinates
+    import Main
+
+    start = time.perf_counter()
+
+    #core relative to the tile region, which is the canvas of the tile's session
+    center_box = (core[0] - region[0], core[1] - region[1], core[2] - region[0], core[3] - region[1])
+
+    #cards must stay inside the region, except on sides where it ends at the border of the target
+    bounds_box = (0 if region[0] > 0 else -np.inf, 0 if region[1] > 0 else -np.inf,
+                  region[2] - region[0] if region[2] < canvas_size[0] else np.inf,
+                  region[3] - region[1] if region[3] < canvas_size[1] else np.inf)
+
+    session = Main.EvolutionSession(tile_path, RESULTS_FOLDER=folder, SHOW_RESULT=False,
+                                    CARD_CENTER_BOX=center_box, CARD_BOUNDS_BOX=bounds_box, **settings)
+    session.run()
+
+    cards = np.array(session.card_list, dtype=Genome.GENOME_DTYPE)
+    cards["x"] += region[0]
+    cards["y"] += region[1]
+
+    return {"index": index, "cards": cards, "loops": session.loop, "fitness": session.committedFitness(),
+            "time": time.perf_counter() - start}
+
+def mergeTiles(results): #cards of all tiles in commit order, n-th card of every tile before (n + 1)-th of any
+    order = []
+
+    for result in results:
+        for n in range(len(result["cards"])):
+            order.append((n, result["index"], result["cards"][n]))
+
+    order.sort(key=lambda item: (item[0], item[1]))
+
+    return np.array([card for _, _, card in order], dtype=Genome.GENOME_DTYPE)
+
+def runTiled(target_path, output, tile_size=TILE_SIZE, overlap=TILE_OVERLAP, jobs=None, settings=None,
+             render=True, progress=None): #tiled run of one target, returns merged cards
+    import Main
+
+    settings = dict(settings or {})
+    settings.setdefault("SNAPSHOT_EVERY", settings.get("MAX_LOOP_COUNT", Main.MAX_LOOP_COUNT) + 1) #no per tile snapshots
+
+    tile_folder = os.path.join(output, "tiles")
+    os.makedirs(tile_folder, exist_ok=True)
+
+    #cutting target into tile files once, workers only open their own tile
+    with Image.open(target_path) as target:
+        width, height = target.size
+        tiles = tileGrid(width, height, tile_size, overlap)
+        tile_paths = []
+
+        for i, (core, region) in enumerate(tiles):
+            path = os.path.join(tile_folder, "tile" + str(i) + ".png")
+            target.crop(region).convert("RGB").save(path, compress_level=1)
+            tile_paths.append(path)
+
+    seed = settings.get("RANDOM_SEED")
+    results = []
+
+    executor = ProcessPoolExecutor(max_workers=jobs or os.cpu_count() or 1, mp_context=get_context("spawn"))
+
+    with executor:
+        futures = []
+
+        for i, ((core, region), path) in enumerate(zip(tiles, tile_paths)):
+            tile_settings = dict(settings)
+
+            if seed is not None: #different but reproducible stream per tile
+                tile_settings["RANDOM_SEED"] = seed * 100003 + i
+
+            futures.append(executor.submit(runTile, i, path, core, region, (width, height), tile_settings,
+                                           os.path.join(tile_folder, "tile" + str(i))))
+
+        for fut in as_completed(futures):
+            results.append(fut.result())
+
+            if progress is not None:
+                progress(len(results), len(tiles), results[-1])
+
+    cards = mergeTiles(sorted(results, key=lambda result: result["index"]))
+
+    config = Main.sessionConfig(**settings)
+    deck = Main.Deck(config)
+
+    document_path = os.path.join(output, config["DOCUMENT_FILE"])
+    Export.writeDocument(document_path, (width, height), (config["CARD_STANDART_WIDTH"], config["CARD_STANDART_HEIGHT"]),
+                         config["CANVAS_BACKGROUND"], deck.card_files, cards)
+
+    if render:
+        Export.renderDocument(Export.readDocument(document_path), deck.images, os.path.join(output, "result.png"))
+
+    return cards
+
+def main():
+    import Batch
+    import Main
+
+    parser = argparse.ArgumentParser(description="Tiled runs for Image Recreation Using Cards")
+    parser.add_argument("target")
+    parser.add_argument("--output", default="Tiled")
+    parser.add_argument("--tile", type=int, default=TILE_SIZE, help="tile core side in target pixels")
+    parser.add_argument("--overlap", type=int, default=TILE_OVERLAP, help="context around tile core in target pixels")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="number of worker processes")
+    parser.add_argument("--loops", type=int, default=Main.MAX_LOOP_COUNT, help="loops per tile")
+    parser.add_argument("--generations", type=int, default=Main.GENERATIONS_PER_LOOP)
+    parser.add_argument("--simplification", type=int, default=Main.IMAGE_SIMPLIFICATION)
+    parser.add_argument("--seed", type=int, default=Main.RANDOM_SEED)
+    parser.add_argument("--set", type=Batch.parseSetting, action="append", default=[], metavar="NAME=VALUE")
+    parser.add_argument("--no-render", action="store_true", help="only write cards.json")
+
+    args = parser.parse_args()
+
+    settings = {"MAX_LOOP_COUNT": args.loops, "GENERATIONS_PER_LOOP": args.generations,
+                "IMAGE_SIMPLIFICATION": args.simplification, "RANDOM_SEED": args.seed, **dict(args.set)}
+
+    def progress(done, total, result):
+        print("[" + str(done) + "/" + str(total) + "] tile " + str(result["index"]) + f"  fitness {result['fitness']:.5f}"
+              + "  " + str(len(result["cards"])) + " cards" + f"  {result['time']:.1f} s")
+
+    start = time.perf_counter()
+    cards = runTiled(args.target, args.output, args.tile, args.overlap, args.jobs, settings, not args.no_render, progress)
+
+    print(str(len(cards)) + " cards" + f" in {time.perf_counter() - start:.1f} s, written to " + args.output)
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
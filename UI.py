@@ -7,8 +7,11 @@ from tkinter import messagebox, filedialog
 from PIL import Image, ImageTk
 import threading
 import Main
+from Stats import formatStages
+from Preview import PreviewSlot
 
 stop_event = threading.Event()
+preview_slot = PreviewSlot() #newest preview frame of the running evolution
 
 def start():
     def chooseFile(): #choosing target image
@@ -32,20 +35,27 @@ def start():
         
         return bg
     
-    def setPreviewImage(path: str | None): #setting image preview
+    def setPreviewImage(pil: Image.Image | None): #setting image preview
         nonlocal _preview_photo_ref
         
-        if not path:
+        if pil is None:
             preview_label.config(image="", text="No image was generated")
             _preview_photo_ref = None
             return
         
-        pil = Image.open(path)
         pil = makeLetterboxed(pil, PREVIEW_W, PREVIEW_H)
         
         _preview_photo_ref = ImageTk.PhotoImage(pil)
         preview_label.config(image=_preview_photo_ref, text="")
     
+    def pollPreview(): #showing newest frame of preview slot, at most PREVIEW_FPS times per second
+        frame = preview_slot.take()
+        
+        if frame is not None:
+            setPreviewImage(frame[0])
+        
+        root.after(int(1000 / PREVIEW_FPS), pollPreview)
+    
     def changeSSIMPower(*args): #on value change for ssim power
         weight_ssim = 0
         
@@ -96,6 +106,8 @@ def start():
         run_button.config(state="disabled")
         stop_button.config(state="normal")
         progress_var.set("Running...")
+        stats_var.set("")
+        preview_slot.clear()
         setPreviewImage(None)
         
         t = threading.Thread(target=runEvolution,
@@ -112,17 +124,28 @@ def start():
     def runEvolution(loops, generations_per_loop, image_simplification, use_color, weight_color, use_ssim, weight_ssim, target_path):
         current_fitness = 0.0
         
-        def progressCallback(loop, generation, best_fitness, path=None): #callback to get loop/generation/fitness/progress
+        def progressCallback(loop, generation, best_fitness, path=None, event=None, stats=None, errors=None): #callback to get loop/generation/fitness/progress/event/stats/errors
             nonlocal current_fitness
             
+            if errors is not None: #failed snapshots, reported once when run ends
+                msg = "\n".join(errors)
+                root.after(0, lambda: messagebox.showwarning("Snapshots failed", msg))
+            
             if best_fitness != -1:
                 current_fitness = best_fitness
             
+            if stats is not None: #stage breakdown, formatted here so UI thread only sets the text
+                text = formatStages(stats, STATS_TOP)
+                root.after(0, lambda: stats_var.set(text))
+                return
+            
             def updateUI():
-                progress_var.set("Loop: " + str(loop) + " | Generation: " + str(generation) + " | Fitness: " + f"{current_fitness:.5f}")
+                text = "Loop: " + str(loop) + " | Generation: " + str(generation) + " | Fitness: " + f"{current_fitness:.5f}"
                 
-                if path is not None:
-                    setPreviewImage(path) #setting preview image
+                if event is not None: #early stopping events (plateau/rejected/converged)
+                    text += " | " + event
+                
+                progress_var.set(text)
                 
             root.after(0, updateUI)
         
@@ -137,7 +160,8 @@ def start():
                 weight_ssim=weight_ssim,
                 target_path=target_path,
                 progress_callback=progressCallback,
-                stop_event=stop_event)
+                stop_event=stop_event,
+                preview=preview_slot)
         except Exception as e:
             msg = str(e)
             root.after(0, lambda: messagebox.showerror("Error", msg))
@@ -152,8 +176,11 @@ def start():
     #preiew values
     PREVIEW_W = 480
     PREVIEW_H = 480
+    PREVIEW_FPS = 10 #cap of preview refresh rate
     _preview_photo_ref = None 
     
+    STATS_TOP = 6 #stages shown in breakdown
+    
     #window setup
     root = tk.Tk()
     root.title("Card Evolution")
@@ -182,6 +209,7 @@ def start():
     use_color_var = tk.BooleanVar(value=Main.USE_COLOR)
     weight_color_var = tk.StringVar(value=str(int(Main.WEIGHT_COLOR * 100)))
     progress_var = tk.StringVar(value="None")
+    stats_var = tk.StringVar(value="")
     
     #window layout
     row = 0
@@ -233,12 +261,17 @@ def start():
     row+=1
     tk.Label(left, textvariable=progress_var).grid(row=row, column=0, columnspan=3, pady=5)
     
+    row+=1
+    tk.Label(left, textvariable=stats_var, font=("Courier", 9), justify="left").grid(row=row, column=0, columnspan=3, sticky="w", pady=5)
+    
     preview_box = tk.Frame(right, width=PREVIEW_W, height=PREVIEW_H, bg="white")
     preview_box.pack()
     preview_box.pack_propagate(False)
     
     preview_label = tk.Label(preview_box, text="No image was generated", bg="white")
     preview_label.pack(fill="both", expand=True)
+    
+    pollPreview()
 
     root.mainloop()
     